@@ -2,12 +2,12 @@
 # AirysDark-AI_Request.py
 #
 # Centralized AI client for the AirysDark-AI tools.
-# - Primary: OpenAI (chat.completions)
-# - Fallback: llama.cpp CLI
+# - Primary: OpenAI (chat.completions, streamed)
+# - Fallback: llama.cpp (persistent llama-server, one-shot CLI if it can't start)
 # - Handles long logs via safe truncation
 # - Redacts known secrets from logs/context
 # - Simple API:
-#       text = request_ai(task, context_parts=[...], system="...", want_diff=False)
+#       text = request_ai(task, context_parts=[...], dynamic_parts=[...], system="...", want_diff=False)
 #   Returns assistant text (and if want_diff=True, a (text, diff_or_None) tuple).
 #
 # Env (override as needed):
@@ -17,19 +17,28 @@
 #   OPENAI_ORG=...                 (optional)
 #   FALLBACK_PROVIDER=llama|none   (default: llama)
 #   LLAMA_CPP_BIN=llama-cli
-#   MODEL_PATH=models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf
+#   LLAMA_SERVER_BIN=llama-server   (next to LLAMA_CPP_BIN; kept warm for all llama calls; LLAMA_SERVER=off to use the CLI)
+#   LLAMA_SERVER_PORT=8799          (shared with the builder, which uses this module's server)
+#   MODEL_PATH=models/tinyllama-1.1b-chat-v1.0.Q4_0.gguf
 #   LLAMA_CTX=4096
 #   AI_TEMPERATURE=0.2
-#   AI_MAX_PROMPT_TOKENS=2500      (~chars ≈ tokens*4 heuristic)
+#   AI_MAX_PROMPT_TOKENS=2500      (exact count via tiktoken when installed, else chars ≈ tokens*4)
 #   AI_RETRIES=2                   (total attempts per provider)
+#   AI_CACHE=auto|on|off           (auto: cache only when AI_TEMPERATURE == 0)
+#   AI_CACHE_DIR=tools/.ai_cache
+#   AI_CACHE_TTL=86400             (seconds a cached answer stays valid)
 #
 # Notes:
 # - We keep the interface text-first so caller scripts can plug any logs they like.
 # - We redact obvious secrets (OPENAI_API_KEY / BOT_TOKEN / GH token patterns).
 # - We provide extract_unified_diff() helper to consume model outputs that return diffs.
+# - Deterministic requests are answered from an on-disk cache keyed by
+#   sha256(provider|model|temp|system|prompt), so reruns with unchanged logs skip the provider.
 
 from __future__ import annotations
-import os, re, json, time, subprocess, tempfile, pathlib, typing, textwrap
+import os, re, sys, json, time, atexit, signal, hashlib, functools, threading, contextlib, subprocess, tempfile, pathlib, typing, textwrap
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import requests
@@ -37,6 +46,16 @@ except Exception:
     # We tolerate missing requests on callers that won't use OpenAI.
     requests = None  # type: ignore
 
+try:
+    import httpx  # optional: pooled (HTTP/2 when h2 is installed) transport for OpenAI
+except Exception:
+    httpx = None  # type: ignore
+
+try:
+    import tiktoken  # optional: exact token counts instead of the chars/4 heuristic
+except Exception:
+    tiktoken = None  # type: ignore
+
 # -------------------- Config --------------------
 PROVIDER          = os.getenv("PROVIDER", "openai").strip().lower()
 FALLBACK_PROVIDER = os.getenv("FALLBACK_PROVIDER", "llama").strip().lower()
@@ -46,61 +65,191 @@ OPENAI_API_KEY    = os.getenv("OPENAI_API_KEY", "").strip()
 OPENAI_ORG        = os.getenv("OPENAI_ORG", "").strip()
 
 LLAMA_CPP_BIN     = os.getenv("LLAMA_CPP_BIN", "llama-cli")
-LLAMA_MODEL_PATH  = os.getenv("MODEL_PATH", "models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf")
+LLAMA_MODEL_PATH  = os.getenv("MODEL_PATH", "models/tinyllama-1.1b-chat-v1.0.Q4_0.gguf")
+LLAMA_SERVER      = os.getenv("LLAMA_SERVER", "auto").strip().lower()
+LLAMA_SERVER_BIN  = os.getenv("LLAMA_SERVER_BIN", LLAMA_CPP_BIN.replace("llama-cli", "llama-server"))
+LLAMA_SERVER_PORT = int(os.getenv("LLAMA_SERVER_PORT", "8799"))
+LLAMA_SERVER_WAIT = float(os.getenv("LLAMA_SERVER_WAIT", "120"))  # seconds to wait for the model to load
+LLAMA_PID_FILE    = pathlib.Path("/tmp/airysdark_llama.pid")
 
 LLAMA_CTX         = int(os.getenv("LLAMA_CTX", "4096"))
 TEMP              = float(os.getenv("AI_TEMPERATURE", "0.2"))
 RETRIES           = int(os.getenv("AI_RETRIES", "2"))
 MAX_PROMPT_TOKENS = int(os.getenv("AI_MAX_PROMPT_TOKENS", "2500"))  # 1 token ≈ 4 chars heuristic
 
+AI_CACHE          = os.getenv("AI_CACHE", "auto").strip().lower()
+AI_CACHE_DIR      = pathlib.Path(os.getenv("AI_CACHE_DIR", str(pathlib.Path(__file__).resolve().parent / ".ai_cache")))
+AI_CACHE_TTL      = int(os.getenv("AI_CACHE_TTL", "86400"))
+
 # -------------------- Helpers --------------------
 def _approx_char_limit(tokens: int) -> int:
     # crude but practical: ~4 chars per token
     return max(512, tokens * 4)
 
-def _truncate(text: str, max_tokens: int) -> str:
-    limit = _approx_char_limit(max_tokens)
+_CHAR_LIMIT = _approx_char_limit(MAX_PROMPT_TOKENS)  # fixed for the process lifetime
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None  # e.g. BPE file not cached and no network
+
+@functools.lru_cache(maxsize=256)
+def _count_tokens(text: str) -> int:
+    # str hashes are cached by CPython, so repeat lookups of the same block are O(1)
+    return len(_encoding().encode(text, disallowed_special=()))
+
+def _stub_block(block: str) -> str:
+    # keep "## Context N" plus the part's own "## ..." title so the model knows what is missing
+    lines = block.split("\n", 2)
+    title = lines[:2] if len(lines) > 1 and lines[1].startswith("#") else lines[:1]
+    return "\n".join(title) + "\n(omitted to fit the token budget)"
+
+def _fit_blocks(blocks: list[str], order: list[int], max_tokens: int) -> list[str] | None:
+    """
+    Token-exact fitting: replace whole blocks, in the given order, with a
+    one-line stub until the prompt fits. Returns None when tiktoken is
+    unavailable or stubbing every listed block is not enough.
+    """
+    if _encoding() is None:
+        return None
+    blocks = list(blocks)
+    sep = _count_tokens("\n\n")
+    total = sum(_count_tokens(b) for b in blocks) + sep * (len(blocks) - 1)
+    for i in order:
+        if total <= max_tokens:
+            return blocks
+        stub = _stub_block(blocks[i])
+        total += _count_tokens(stub) - _count_tokens(blocks[i])
+        blocks[i] = stub
+    return blocks if total <= max_tokens else None
+
+# Dynamic content (log tails, attempt state) is bracketed by these sentinels so
+# truncation never touches the static prefix the provider may have cached.
+_DYN_OPEN  = "<<DYNAMIC>>"
+_DYN_CLOSE = "<</DYNAMIC>>"
+
+def _cut_middle(text: str, limit: int) -> str:
     if len(text) <= limit:
         return text
-    head = text[: int(limit*0.60)]
-    tail = text[- int(limit*0.35):]
+    # slice the UTF-8 bytes (cheap for mostly-ASCII logs); a split multi-byte
+    # char at either cut is dropped by errors="ignore"
+    b = memoryview(text.encode("utf-8", "ignore"))
+    head = bytes(b[: limit*3//5]).decode("utf-8", "ignore")
+    tail = bytes(b[-(limit*7//20):]).decode("utf-8", "ignore")
     return head + "\n\n[...truncated to fit context...]\n\n" + tail
 
+def _truncate(text: str, max_tokens: int = MAX_PROMPT_TOKENS) -> str:
+    limit = _CHAR_LIMIT if max_tokens == MAX_PROMPT_TOKENS else _approx_char_limit(max_tokens)
+    if len(text) <= limit:
+        return text
+    start = text.find(_DYN_OPEN)
+    end = text.find(_DYN_CLOSE)
+    if start < 0 or end < start:
+        return _cut_middle(text, limit)
+    static = text[:start]
+    dynamic = text[start + len(_DYN_OPEN):end]
+    rest = text[end + len(_DYN_CLOSE):]
+    budget = limit - len(static) - len(rest)
+    if budget < 512:
+        # static prefix alone blows the budget; trim the whole prompt instead
+        return _cut_middle(static + dynamic + rest, limit)
+    return static + _cut_middle(dynamic, budget) + rest
+
 _SECRET_PATTERNS = [
     (re.compile(r"(?:sk-|rk-)[A-Za-z0-9]{20,}"), "[REDACTED_API_KEY]"),        # OpenAI-like keys
     (re.compile(r"ghp_[A-Za-z0-9]{36,}"), "[REDACTED_GH_PAT]"),               # GitHub classic PAT
     (re.compile(r"github_pat_[A-Za-z0-9_]{20,}"), "[REDACTED_GH_FG_PAT]"),    # GitHub fine-grained PAT
 ]
+_REDACT_ENV_KEYS = ("OPENAI_API_KEY", "BOT_TOKEN", "GITHUB_TOKEN")
+
+def _build_redactor() -> tuple[re.Pattern, dict[str, str]]:
+    """
+    One compiled alternation covering env secret values + generic patterns,
+    so redact() is a single scan.
+    """
+    alts, repl = [], {}
+    # direct env values first so they win over the generic patterns
+    for i, env_key in enumerate(_REDACT_ENV_KEYS):
+        val = os.getenv(env_key, "")
+        if val:
+            alts.append(f"(?P<e{i}>{re.escape(val)})")
+            repl[f"e{i}"] = f"[REDACTED_{env_key}]"
+    for i, (pat, r) in enumerate(_SECRET_PATTERNS):
+        alts.append(f"(?P<g{i}>{pat.pattern})")
+        repl[f"g{i}"] = r
+    return re.compile("|".join(alts)), repl
+
+# env secrets don't change during a run: snapshot them once at import
+_REDACT_RX, _REDACT_REPL = _build_redactor()
+
 def redact(text: str) -> str:
-    out = text
-    # direct env values
-    for env_key in ("OPENAI_API_KEY", "BOT_TOKEN", "GITHUB_TOKEN"):
-        if os.getenv(env_key):
-            val = re.escape(os.getenv(env_key, ""))
-            if val:
-                out = re.sub(val, f"[REDACTED_{env_key}]", out)
-    # generic patterns
-    for pat, repl in _SECRET_PATTERNS:
-        out = pat.sub(repl, out)
-    return out
+    return _REDACT_RX.sub(lambda m: _REDACT_REPL[m.lastgroup], text)
+
+_DIFF_RE = re.compile(r"(?ms)^--- [^\n]+\n\+\+\+ [^\n]+\n(?:@@.*\n.*)+")
+_DIFF_HDR_RE = re.compile(r"(?ms)^--- [^\n]+\n\+\+\+ [^\n]+\n")
+
+def _diff_headers_rev(s: str):
+    """Yield offsets of '--- ' line starts, last one first."""
+    i = len(s)
+    while True:
+        i = s.rfind("\n--- ", 0, i)
+        if i < 0:
+            break
+        yield i + 1
+    if s.startswith("--- "):
+        yield 0
+
+# Line starts that can appear inside a multi-file git/unified diff.
+_DIFF_LINE_PREFIXES = (
+    " ", "+", "-", "@@", "\\", "diff ", "index ", "new file mode", "deleted file mode",
+    "old mode", "new mode", "similarity index", "dissimilarity index",
+    "rename from", "rename to", "copy from", "copy to", "Binary files",
+)
+
+def _all_diff_lines(s: str, begin: int, end: int) -> bool:
+    return all(not ln or ln.startswith(_DIFF_LINE_PREFIXES) for ln in s[begin:end].splitlines())
 
 def extract_unified_diff(s: str) -> str | None:
     """
     Try to extract a unified diff (---/+++ with @@ hunks).
+    Models put the diff at the end, so walk file headers backwards from the
+    tail: the last header with hunks anchors the diff, and each earlier
+    ---/+++ header extends it while everything in between is diff text
+    (hunkless sections such as mode-only changes or new empty files included).
     Returns the diff string if found, else None.
     """
-    m = re.search(r"(?ms)^--- [^\n]+\n\+\+\+ [^\n]+\n(?:@@.*\n.*)+", s)
-    if m:
-        return s[m.start():].strip()
+    start = None
+    for pos in _diff_headers_rev(s):
+        if not _DIFF_HDR_RE.match(s, pos):
+            continue  # a removed "-- ..." line inside a hunk, not a header
+        if start is None:
+            if _DIFF_RE.match(s, pos):
+                start = pos
+        elif _all_diff_lines(s, pos, start):
+            start = pos
+        else:
+            break
+    if start is not None:
+        return s[start:].strip()
     # fallback: find first ---/+++ block
-    m2 = re.search(r"(?ms)^--- [^\n]+\n\+\+\+ [^\n]+\n", s)
+    m2 = _DIFF_HDR_RE.search(s)
     if not m2:
         return None
     return s[m2.start():].strip()
 
-def _assemble_prompt(task: str, context_parts: list[str] | None, want_diff: bool) -> str:
+def _assemble_prompt(task: str, context_parts: list[str] | None, want_diff: bool,
+                     dynamic_parts: list[str] | None = None) -> str:
     """
     Build a single plain-text prompt for both providers.
+    Static content (header, rules, context_parts) comes first so the prefix stays
+    byte-identical across attempts; task + dynamic_parts follow and are the only
+    region trimmed when the prompt is too long.
     """
     goal = task.strip()
     if not goal:
@@ -113,27 +262,187 @@ def _assemble_prompt(task: str, context_parts: list[str] | None, want_diff: bool
     if want_diff:
         header.append("If proposing code/config changes, return ONLY a valid unified diff (---/+++ with @@ hunks).")
 
-    blocks = []
-    for idx, part in enumerate(context_parts or [], start=1):
+    # identical blocks are sent once; repeats become a short reference
+    idx = 0
+    seen: dict[str, int] = {}
+    referenced: set[int] = set()
+    def _block(part: str) -> str:
+        body = part.strip()
+        sha = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        if sha in seen:
+            referenced.add(seen[sha])
+            return f"## Context {idx}\n(same as Context {seen[sha]})"
+        seen[sha] = idx
+        return f"## Context {idx}\n{body}"
+
+    static_blocks, static_ids = [], []
+    for part in context_parts or []:
+        idx += 1
+        if not part:
+            continue
+        static_blocks.append(_block(part))
+        static_ids.append(idx)
+
+    dynamic_blocks, dynamic_ids = [f"## Task\n{goal}"], [0]
+    for part in dynamic_parts or []:
+        idx += 1
         if not part:
             continue
-        blocks.append(f"## Context {idx}\n{part.strip()}")
+        dynamic_blocks.append(_block(part))
+        dynamic_ids.append(idx)
+
+    # Exact path: drop whole context blocks rather than splicing mid-string
+    n_static = 1 + len(static_blocks)  # header + context blocks
+    blocks = [redact(b) for b in ["\n".join(header), *static_blocks, *dynamic_blocks]]
+    ids = [0, *static_ids, *dynamic_ids]
+    # Older dynamic blocks go first, static ones (the cached prefix) only as a
+    # last resort. Header, task, the newest block and any block another one
+    # refers to are never dropped; if they alone overflow, fall through to the
+    # char-based trim below.
+    last = len(blocks) - 1
+    order = [i for i in (*range(n_static + 1, last), *range(1, n_static)) if ids[i] not in referenced]
+    fitted = _fit_blocks(blocks, order, MAX_PROMPT_TOKENS)
+    if fitted is not None:
+        return "\n\n".join(fitted)
 
     prompt = "\n\n".join([
-        "\n".join(header),
-        f"## Task\n{goal}",
-        *blocks
+        *blocks[:n_static],
+        _DYN_OPEN + "\n\n".join(blocks[n_static:]) + _DYN_CLOSE,
     ])
 
-    # Safety: redact secrets and truncate
-    prompt = redact(prompt)
+    # Fallback: truncate by the chars/token heuristic (dynamic region only)
     prompt = _truncate(prompt, MAX_PROMPT_TOKENS)
-    return prompt
+    return prompt.replace(_DYN_OPEN, "").replace(_DYN_CLOSE, "")
+
+# -------------------- Response cache --------------------
+_CACHE_STATS = {"hits": 0, "misses": 0, "writes": 0}
+
+def _cache_enabled(cache: bool | None, temp: float) -> bool:
+    if cache is not None:
+        return cache
+    if AI_CACHE in ("off", "0", "false", "no"):
+        return False
+    if AI_CACHE in ("on", "1", "true", "yes"):
+        return True
+    return temp <= 0.01
+
+def _cache_key(provider: str, temp: float, system: str | None, prompt: str) -> str:
+    raw = json.dumps({"p": provider, "m": OPENAI_MODEL, "t": temp, "s": system or "", "u": prompt}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cache_get(key: str, want_diff: bool) -> str | None:
+    path = AI_CACHE_DIR / f"{key}.json"
+    try:
+        entry = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        _CACHE_STATS["misses"] += 1
+        return None
+    expired = time.time() - float(entry.get("ts", 0)) > AI_CACHE_TTL
+    # an answer that gave no usable diff last time is worth asking again
+    if expired or (want_diff and not entry.get("has_diff")):
+        _CACHE_STATS["misses"] += 1
+        return None
+    _CACHE_STATS["hits"] += 1
+    return entry.get("text", "")
+
+def _cache_put(key: str, text: str, has_diff: bool) -> None:
+    try:
+        AI_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        entry = {"ts": time.time(), "ttl": AI_CACHE_TTL, "has_diff": has_diff, "text": text}
+        fd, tmp = tempfile.mkstemp(dir=str(AI_CACHE_DIR), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, AI_CACHE_DIR / f"{key}.json")
+        _CACHE_STATS["writes"] += 1
+    except Exception:
+        pass  # cache is best-effort
+
+@atexit.register
+def _flush_cache_stats():
+    if any(_CACHE_STATS.values()):
+        print("[ai-cache] hits={hits} misses={misses} writes={writes}".format(**_CACHE_STATS), file=sys.stderr)
 
 # -------------------- Providers --------------------
-def _openai_call(messages: list[dict]) -> str:
-    if requests is None:
-        raise RuntimeError("requests module not available (needed for OpenAI).")
+_HTTP_CLIENT = None  # created on first OpenAI call, reused for keep-alive
+
+def _http_client():
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        if httpx is not None:
+            timeout = httpx.Timeout(180, connect=10)
+            try:
+                _HTTP_CLIENT = httpx.Client(http2=True, timeout=timeout)
+            except ImportError:  # httpx without the h2 extra
+                _HTTP_CLIENT = httpx.Client(timeout=timeout)
+        elif requests is not None:
+            _HTTP_CLIENT = requests.Session()
+    return _HTTP_CLIENT
+
+@contextlib.contextmanager
+def _post_stream(url: str, headers: dict, payload: dict):
+    """Yields (status_code, error_text, line_iterator) for a streamed POST."""
+    client = _http_client()
+    if httpx is not None and isinstance(client, httpx.Client):
+        with client.stream("POST", url, headers=headers, json=payload) as r:
+            err = r.read().decode("utf-8", "ignore") if r.status_code >= 400 else ""
+            yield r.status_code, err, r.iter_lines()
+    else:
+        with client.post(url, headers=headers, json=payload, timeout=180, stream=True) as r:
+            err = r.text if r.status_code >= 400 else ""
+            yield r.status_code, err, r.iter_lines(decode_unicode=True)
+
+def _read_sse(lines: typing.Iterable[str], stop_after_diff: bool = False) -> list[str]:
+    """
+    Accumulate choices[i].delta.content from an OpenAI SSE stream, one string
+    per choice index. With stop_after_diff, stop reading once a diff has
+    started ("+++ " header line) and a later line opens with ``` (the model
+    closing its code fence; whatever follows is prose we would discard anyway).
+    Fences inside hunks never start a line, so Markdown patches stay whole.
+    An error event in the stream raises RuntimeError("openai_error: ...").
+    """
+    parts: dict[int, list[str]] = {}
+    # per choice: (in_diff, last 4 chars) -- markers spanning two deltas are
+    # found without re-joining the whole buffer on every delta
+    scan: dict[int, tuple[bool, str]] = {}
+    for raw in lines:
+        if not raw or not raw.startswith("data:"):
+            continue
+        data = raw[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except Exception:
+            continue
+        if chunk.get("error"):  # mid-stream failure: don't pass partial text off as an answer
+            raise RuntimeError("openai_error: " + json.dumps(chunk["error"]))
+        for choice in chunk.get("choices") or ():
+            delta = (choice.get("delta") or {}).get("content") or ""
+            if not delta:
+                continue
+            idx = choice.get("index", 0)
+            buf = parts.setdefault(idx, [])
+            if stop_after_diff:
+                in_diff, tail = scan.get(idx, (False, "\n"))  # "\n": text start is a line start
+                window = tail + delta
+                if not in_diff:
+                    hdr = window.find("\n+++ ")
+                    in_diff = hdr >= 0
+                    fence_from = hdr + 1
+                else:
+                    fence_from = 0
+                if in_diff and window.find("\n```", fence_from) >= 0:
+                    buf.append(delta)
+                    return ["".join(buf)]
+                scan[idx] = (in_diff, window[-4:])
+            buf.append(delta)
+    return ["".join(parts[i]) for i in sorted(parts)] or [""]
+
+def _openai_call(messages: list[dict], stop_after_diff: bool = False, temperature: float | None = None,
+                 n: int = 1) -> str:
+    """Chat completion; with n > 1 the candidates come back joined by blank lines, in choice order."""
+    if requests is None and httpx is None:
+        raise RuntimeError("requests/httpx module not available (needed for OpenAI).")
     if not OPENAI_API_KEY:
         raise RuntimeError("missing OPENAI_API_KEY for OpenAI provider.")
 
@@ -148,37 +457,172 @@ def _openai_call(messages: list[dict]) -> str:
     payload = {
         "model": OPENAI_MODEL,
         "messages": messages,
-        "temperature": TEMP,
+        "temperature": TEMP if temperature is None else temperature,
+        "stream": True,
     }
+    if n > 1:
+        payload["n"] = n
+        stop_after_diff = False  # choices interleave; read them all
 
     last_err = None
     for attempt in range(1, RETRIES+1):
         try:
-            r = requests.post(url, headers=headers, json=payload, timeout=180)
-            if r.status_code >= 400:
-                last_err = f"HTTP {r.status_code}: {r.text}"
-                # Backoff for transient 429/5xx
-                if r.status_code in (429, 500, 502, 503):
-                    time.sleep(1.5 * attempt)
-                    continue
-                raise RuntimeError(f"OpenAI error: {last_err}")
-            data = r.json()
-            return data["choices"][0]["message"]["content"]
+            with _post_stream(url, headers, payload) as (status, err, lines):
+                if status >= 400:
+                    last_err = f"HTTP {status}: {err}"
+                    # Backoff for transient 429/5xx
+                    if status in (429, 500, 502, 503):
+                        time.sleep(1.5 * attempt)
+                        continue
+                    raise RuntimeError(f"OpenAI error: {last_err}")
+                return "\n\n".join(_read_sse(lines, stop_after_diff))
         except Exception as e:
             last_err = str(e)
             time.sleep(1.0 * attempt)
     raise RuntimeError(f"OpenAI failed after {RETRIES} attempts: {last_err}")
 
-def _llama_call(prompt: str) -> str:
+_LLAMA_PROC: subprocess.Popen | None = None
+_LLAMA_ADOPTED: int | None = None  # pid of a leftover server whose owner is gone; we stop it
+_LLAMA_STATE = "new"  # new | up | failed
+_LLAMA_LOCK = threading.Lock()
+
+def _llama_url(path: str) -> str:
+    return f"http://127.0.0.1:{LLAMA_SERVER_PORT}{path}"
+
+# LLAMA_PID_FILE holds "<server pid> <owner pid>". Every tool that talks to
+# llama-server (this module, and the builder through it) goes through the same
+# port and file, so one loaded model serves them all.
+def _read_llama_pid_file() -> tuple[int, int] | None:
+    try:
+        srv, owner = LLAMA_PID_FILE.read_text().split()[:2]
+        return int(srv), int(owner)
+    except (OSError, ValueError):
+        return None
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _llama_health() -> bool:
+    try:
+        with urllib.request.urlopen(_llama_url("/health"), timeout=2) as r:
+            return r.status == 200
+    except Exception:
+        return False  # 503 while the model loads, or not listening yet
+
+def _wait_llama_health(alive: typing.Callable[[], bool]) -> bool:
+    deadline = time.time() + LLAMA_SERVER_WAIT
+    while time.time() < deadline and alive():  # dead early: e.g. port already bound
+        if _llama_health():
+            return True
+        time.sleep(0.5)
+    return False
+
+def _stop_llama_server():
+    if _LLAMA_PROC and _LLAMA_PROC.poll() is None:
+        _LLAMA_PROC.terminate()
+        try:
+            _LLAMA_PROC.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _LLAMA_PROC.kill()
+    elif _LLAMA_ADOPTED and _pid_alive(_LLAMA_ADOPTED):
+        os.kill(_LLAMA_ADOPTED, signal.SIGTERM)
+    prior = _read_llama_pid_file()
+    if prior and prior[1] == os.getpid():
+        LLAMA_PID_FILE.unlink(missing_ok=True)
+
+def _reuse_llama_server() -> bool | None:
+    """
+    Look at a server recorded by an earlier or concurrent run. True: it is
+    healthy, use it (adopting it for shutdown if its owner has exited).
+    False: its live owner is still loading it and it never came up.
+    None: nothing usable (a stale one whose owner is gone is reaped); start our own.
+    """
+    global _LLAMA_ADOPTED
+    prior = _read_llama_pid_file()
+    if prior is None:
+        return True if _llama_health() else None  # unmanaged server already on the port
+    srv, owner = prior
+    owner_alive = owner != os.getpid() and _pid_alive(owner)
+    if _pid_alive(srv):
+        if owner_alive:
+            return _wait_llama_health(lambda: _pid_alive(srv))
+        if _llama_health():
+            _LLAMA_ADOPTED = srv
+            LLAMA_PID_FILE.write_text(f"{srv} {os.getpid()}")
+            atexit.register(_stop_llama_server)
+            return True
+        os.kill(srv, signal.SIGTERM)  # leftover that never became healthy
+    LLAMA_PID_FILE.unlink(missing_ok=True)
+    return None
+
+def _llama_server_up() -> bool:
+    """
+    Start llama-server once (continuous batching, 2 slots so speculative
+    calls share one loaded model) and wait for /health, reusing a server left
+    by another run when there is one. False means use the CLI.
+    """
+    global _LLAMA_PROC, _LLAMA_STATE
+    with _LLAMA_LOCK:
+        if _LLAMA_STATE != "new":
+            return _LLAMA_STATE == "up"
+        _LLAMA_STATE = "failed"
+        if LLAMA_SERVER in ("off", "0", "no"):
+            return False
+        reused = _reuse_llama_server()
+        if reused is not None:
+            _LLAMA_STATE = "up" if reused else "failed"
+            return reused
+        args = [
+            LLAMA_SERVER_BIN,
+            "-m", LLAMA_MODEL_PATH,
+            "-c", str(LLAMA_CTX),
+            "-np", "2", "-cb",
+            "--host", "127.0.0.1",
+            "--port", str(LLAMA_SERVER_PORT),
+        ]
+        try:
+            _LLAMA_PROC = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            return False
+        atexit.register(_stop_llama_server)
+        LLAMA_PID_FILE.write_text(f"{_LLAMA_PROC.pid} {os.getpid()}")
+        if _wait_llama_health(lambda: _LLAMA_PROC.poll() is None):
+            _LLAMA_STATE = "up"
+            return True
+        _stop_llama_server()
+        return False
+
+def _llama_server_call(prompt: str, temperature: float) -> str:
+    # cache_prompt: a prefix shared by consecutive calls stays in the KV cache
+    body = json.dumps({"prompt": prompt, "temperature": temperature, "n_predict": 2048,
+                       "cache_prompt": True}).encode("utf-8")
+    req = urllib.request.Request(_llama_url("/completion"), data=body,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=600) as r:
+        return json.loads(r.read().decode("utf-8")).get("content", "")
+
+def _llama_call(prompt: str, temperature: float | None = None) -> str:
     mp = pathlib.Path(LLAMA_MODEL_PATH)
     if not mp.exists():
         raise RuntimeError(f"llama model not found at: {mp}")
+    temp = TEMP if temperature is None else temperature
+    if _llama_server_up():
+        try:
+            return _llama_server_call(prompt, temp)
+        except Exception:
+            pass  # server died mid-run; the one-shot CLI below still works
     args = [
         LLAMA_CPP_BIN,
         "-m", str(mp),
         "-p", prompt,
         "-n", "2048",
-        "--temp", str(TEMP),
+        "--temp", str(temp),
         "-c", str(LLAMA_CTX),
     ]
     last_err = None
@@ -196,26 +640,68 @@ def _llama_call(prompt: str) -> str:
     raise RuntimeError(f"llama.cpp failed after {RETRIES} attempts: {last_err}")
 
 # -------------------- Public API --------------------
+def warm_llama() -> None:
+    """
+    Start llama-server in the background (no-op without a model file), so a
+    later llama fallback doesn't pay the model load on the critical path.
+    """
+    if pathlib.Path(LLAMA_MODEL_PATH).exists():
+        threading.Thread(target=_llama_server_up, daemon=True).start()
+
+def openai_complete(prompt: str, *, system: str | None = None, temperature: float | None = None) -> str:
+    """
+    One chat completion for a ready-made prompt over the shared keep-alive
+    client. No prompt assembly, redaction, cache or fallback.
+    """
+    msgs = []
+    if system:
+        msgs.append({"role": "system", "content": system})
+    msgs.append({"role": "user", "content": prompt})
+    return _openai_call(msgs, temperature=temperature)
+
+def llama_complete(prompt: str, temperature: float | None = None) -> str:
+    """
+    Plain completion from the local model: the shared llama-server when it
+    is up, else llama-cli. No prompt assembly, redaction or cache.
+    """
+    return _llama_call(prompt, temperature=temperature)
+
 def request_ai(
     task: str,
     *,
     context_parts: list[str] | None = None,
+    dynamic_parts: list[str] | None = None,
     system: str | None = None,
     want_diff: bool = False,
     provider: str | None = None,
     fallback_provider: str | None = None,
+    cache: bool | None = None,
+    temperature: float | None = None,
+    n: int = 1,
 ) -> str | tuple[str, str | None]:
     """
     High-level request:
-      - Builds a safe prompt from task + context_parts
+      - Builds a safe prompt from task + context_parts (static) + dynamic_parts
+      - Answers from the on-disk cache for deterministic requests (TEMP==0 or cache=True)
       - Calls primary provider (default: env PROVIDER)
       - Falls back (default: llama) on error/quota
+      - n > 1 asks OpenAI for n candidates in one request (joined, in order)
       - Returns assistant text (or (text, diff) if want_diff=True)
     """
     provider = (provider or PROVIDER).lower()
     fallback_provider = (fallback_provider or FALLBACK_PROVIDER).lower()
+    temp = TEMP if temperature is None else temperature
 
-    prompt = _assemble_prompt(task, context_parts, want_diff)
+    prompt = _assemble_prompt(task, context_parts, want_diff, dynamic_parts)
+
+    use_cache = _cache_enabled(cache, temp)
+    key = _cache_key(f"{provider}|{fallback_provider}|n{n}", temp, system, prompt) if use_cache else ""
+    if use_cache:
+        cached = _cache_get(key, want_diff)
+        if cached is not None:
+            if want_diff:
+                return cached, extract_unified_diff(cached)
+            return cached
 
     def _run_primary() -> str:
         if provider == "openai":
@@ -223,40 +709,74 @@ def request_ai(
             if system:
                 msgs.append({"role": "system", "content": system})
             msgs.append({"role": "user", "content": prompt})
-            return _openai_call(msgs)
+            return _openai_call(msgs, stop_after_diff=want_diff, temperature=temp, n=n)
         elif provider == "llama":
-            return _llama_call(prompt)
+            return _llama_call(prompt, temperature=temp)
         else:
             raise RuntimeError(f"Unknown PROVIDER='{provider}'")
 
     def _run_fallback() -> str:
         if fallback_provider == "llama":
-            return _llama_call(prompt)
+            return _llama_call(prompt, temperature=temp)
         elif fallback_provider == "openai":
             msgs = []
             if system:
                 msgs.append({"role": "system", "content": system})
             msgs.append({"role": "user", "content": prompt})
-            return _openai_call(msgs)
+            return _openai_call(msgs, stop_after_diff=want_diff, temperature=temp, n=n)
         elif fallback_provider in ("", "none", "null"):
             raise RuntimeError("No fallback provider configured.")
         else:
             raise RuntimeError(f"Unknown FALLBACK_PROVIDER='{fallback_provider}'")
 
     text = ""
+    from_primary = True
     try:
         text = _run_primary()
     except Exception as e:
         # only fallback for quota/transient or if configured
+        from_primary = False
         try:
             text = _run_fallback()
         except Exception as e2:
             raise RuntimeError(f"AI request failed (primary + fallback): {e} // {e2}")
 
+    diff = extract_unified_diff(text) if want_diff else None
+    # the key names the primary provider; a fallback answer must not stand in for it
+    if use_cache and from_primary:
+        _cache_put(key, text, diff is not None)
     if want_diff:
-        return text, extract_unified_diff(text)
+        return text, diff
     return text
 
+def request_ai_many(
+    task: str,
+    *,
+    n: int = 3,
+    temperatures: list[float] | None = None,
+    **kwargs,
+) -> typing.Iterator[str | tuple[str, str | None]]:
+    """
+    Speculative variant of request_ai: issues n requests concurrently (with
+    slightly different temperatures) and yields answers as they complete.
+    Failed requests are skipped. All n start at once, so once you stop
+    iterating the generator returns without waiting: requests still in flight
+    finish in the background and their answers are dropped.
+    """
+    temps = list(temperatures or [0.1, 0.3, 0.5])
+    n = max(1, n)
+    ex = ThreadPoolExecutor(max_workers=n)
+    futs = [ex.submit(request_ai, task, temperature=temps[i % len(temps)], **kwargs) for i in range(n)]
+    try:
+        for fut in as_completed(futs):
+            try:
+                yield fut.result()
+            except Exception:
+                continue
+    finally:
+        # not `with`: its exit would block on every outstanding request
+        ex.shutdown(wait=False, cancel_futures=True)
+
 # -------------------- CLI (useful for quick tests) --------------------
 def _cli():
     import argparse, sys
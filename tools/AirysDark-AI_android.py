@@ -19,15 +19,23 @@
 #  MODEL_PATH=...gguf, LLAMA_CPP_BIN=llama-cli, LLAMA_CTX=4096
 #  AI_BUILDER_ATTEMPTS=3  (how many fix attempts)
 #  AI_LOG_TAIL=160        (tail lines for build.log in prompts)
+#  AI_FIX_CANDIDATES=3    (parallel speculative fix requests per failed build)
+#  AI_BUILD_TIMEOUT=0     (seconds before a hung build's process group is killed; 0 = no limit)
 #
 # Usage in workflow:
 #   - name: Android runner
 #     run: python3 tools/AirysDark-AI_android.py --mode run
 
 from __future__ import annotations
-import os, sys, json, re, shlex, textwrap, datetime, tempfile, subprocess, pathlib
+import os, sys, json, re, shlex, signal, hashlib, textwrap, datetime, subprocess, pathlib, functools, itertools, threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
 
+try:
+    import pygit2  # optional: read tree/diff in-process instead of shelling out to git
+except Exception:
+    pygit2 = None  # type: ignore
+
 ROOT  = pathlib.Path(".").resolve()
 WF    = ROOT / ".github" / "workflows"
 TOOLS = ROOT / "tools"
@@ -37,6 +45,8 @@ TOOLS.mkdir(parents=True, exist_ok=True)
 # ---- Tunables ----
 MAX_FIX_ATTEMPTS = int(os.getenv("AI_BUILDER_ATTEMPTS", "3"))
 AI_LOG_TAIL      = int(os.getenv("AI_LOG_TAIL", "160"))
+AI_FIX_CANDIDATES = int(os.getenv("AI_FIX_CANDIDATES", "3"))
+AI_BUILD_TIMEOUT  = float(os.getenv("AI_BUILD_TIMEOUT", "0") or 0)
 
 # ---- Files ----
 BUILD_LOG       = ROOT / "build.log"
@@ -45,7 +55,11 @@ ANDROID_JSON    = TOOLS / "android_probe.json"
 AI_OUT_TXT      = TOOLS / "android_ai_response.txt"     # last AI answer (debug)
 PATCH_SNAPSHOT  = ROOT  / ".pre_ai_fix.patch"
 
+# git apply output / conflict markers from the last rejected diff (fed into the next prompt)
+_LAST_REJECT = ""
+
 # ---- Import centralized requester (OpenAI → llama fallback) ----
+@functools.lru_cache(maxsize=1)  # exec the module once per process
 def _load_requester():
     import importlib.util
     req = TOOLS / "AirysDark-AI_Request.py"
@@ -66,6 +80,18 @@ def sh(cmd: str, cwd: Optional[pathlib.Path]=None, check: bool=False, capture: b
         raise subprocess.CalledProcessError(p.returncode, cmd, output=(p.stdout or ""))
     return p.stdout or ""
 
+def write_if_changed(path: pathlib.Path, text: str | bytes) -> bool:
+    """Write text unless the file already holds identical bytes (keeps git clean)."""
+    new = text.encode("utf-8") if isinstance(text, str) else text
+    try:
+        # plain bytes compare: stops at a length mismatch, no hashing of either side
+        if path.read_bytes() == new:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(new)
+    return True
+
 # ---- repo helpers ----
 def ensure_git_repo():
     if not (ROOT / ".git").exists():
@@ -75,21 +101,101 @@ def ensure_git_repo():
         sh("git add -A", check=False)
         sh('git commit -m "bootstrap repo for android runner" || true', check=False)
 
+@functools.lru_cache(maxsize=1)
+def _git_repo():
+    if pygit2 is None:
+        return None
+    try:
+        return pygit2.Repository(str(ROOT))
+    except Exception:
+        return None
+
+_SKIP_DIRS = {".git", ".gradle", ".idea", "build", "node_modules", "__pycache__"}
+
+def _iter_git_ls_files():
+    """Tracked paths streamed from `git ls-files`, killed once the caller stops
+    reading; None if git can't be started."""
+    try:
+        p = subprocess.Popen(["git", "-c", "core.quotePath=off", "ls-files"], cwd=ROOT, text=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+    def lines():
+        try:
+            for ln in p.stdout:
+                yield ln.rstrip("\n")
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.wait()
+            p.stdout.close()
+    return lines()
+
+def _walk_files():
+    # no-git fallback: sorted walk (ignores .gitignore), stops as soon as the caller has enough
+    for dirpath, dirnames, filenames in os.walk(ROOT):
+        dirnames[:] = sorted(d for d in dirnames if d not in _SKIP_DIRS)
+        rel = os.path.relpath(dirpath, ROOT)
+        prefix = "" if rel == "." else rel.replace(os.sep, "/") + "/"
+        for name in sorted(filenames):
+            yield prefix + name
+
 def repo_tree(limit=200) -> str:
-    out = sh("git ls-files || true")
-    files = [ln for ln in out.splitlines() if ln.strip()]
-    return "\n".join(files[:limit]) if files else "(no tracked files)";
+    repo = _git_repo()
+    files = None
+    if repo is not None:
+        try:
+            idx = repo.index
+            idx.read()  # pick up index changes from apply_patch
+            files = [e.path for e in itertools.islice(idx, limit)]
+        except Exception:
+            files = None
+    if files is None and (ROOT / ".git").exists():
+        # without pygit2, tracked files only: untracked build.log / patches /
+        # responses would otherwise leak into the prompt and the _tree_sig
+        tracked = _iter_git_ls_files()
+        if tracked is not None:
+            files = list(itertools.islice(tracked, limit))
+            tracked.close()
+    if files is None:
+        files = list(itertools.islice(_walk_files(), limit))
+    return "\n".join(files) if files else "(no tracked files)";
 
 def recent_diff(max_chars=3000) -> str:
-    diff = sh("git diff --unified=2 -M -C HEAD~5..HEAD || true")
+    repo = _git_repo()
+    diff = None
+    if repo is not None:
+        try:
+            d = repo.diff(repo.revparse_single("HEAD~5"), repo.revparse_single("HEAD"), context_lines=2)
+            d.find_similar()  # like -M -C
+            diff = d.patch or ""
+        except Exception:
+            diff = None
+    if diff is None:
+        diff = sh("git diff --unified=2 -M -C HEAD~5..HEAD || true")
     return diff[-max_chars:] if diff else "(no recent git diff)"
 
-def build_log_tail(lines=AI_LOG_TAIL) -> str:
+def build_log_tail(lines: int = AI_LOG_TAIL) -> str:
     if not BUILD_LOG.exists():
         return "(no build log)"
-    data = BUILD_LOG.read_text(errors="ignore").splitlines()
-    start = max(0, len(data) - int(lines))
-    return "\n".join(data[start:])
+    with open(BUILD_LOG, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        window = lines * 400  # generous bytes/line estimate; doubled if short
+        while True:
+            start = max(0, size - window)
+            f.seek(start)
+            data = f.read().rstrip(b"\n")
+            # walk back over the last N newlines in bytes; decode only the tail
+            pos = len(data)
+            for _ in range(lines):
+                pos = data.rfind(b"\n", 0, pos)
+                if pos < 0:
+                    break
+            if pos >= 0 or start == 0:
+                return data[pos + 1:].decode("utf-8", "ignore")
+            window *= 2
 
 def append_android_log(lines: List[str]):
     stamp = datetime.datetime.utcnow().isoformat() + "Z"
@@ -99,11 +205,49 @@ def append_android_log(lines: List[str]):
             f.write(ln.rstrip() + "\n")
 
 # ---- build command discovery (AI → llama → heuristic) ----
+@functools.lru_cache(maxsize=1)
+def _scan_android() -> dict:
+    """
+    One walk of the repo collecting the directories holding each kind of Gradle
+    file (plain strings; callers only need the parent dir). Cached; call _scan_android.cache_clear() after the tree changes (apply_patch).
+    """
+    hits = {"gradlew": [], "settings": [], "build_gradle": []}
+    # scandir stack in os.walk (pre-order) order; is_dir comes from the cached
+    # d_type. _SKIP_DIRS keeps build outputs and node_modules (whose React Native
+    # packages ship their own build.gradle) out of the module guesses.
+    stack = [str(ROOT)]
+    while stack:
+        r = stack.pop()
+        subdirs = []
+        try:
+            it = os.scandir(r)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                fn = entry.name
+                try:
+                    if entry.is_dir():
+                        # like os.walk: dir symlinks are not files and not followed
+                        if fn not in _SKIP_DIRS and not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                except OSError:
+                    continue
+                if fn == "gradlew":
+                    hits["gradlew"].append(r)
+                elif fn.startswith("settings.gradle"):
+                    hits["settings"].append(r)
+                elif fn.startswith("build.gradle"):
+                    hits["build_gradle"].append(r)
+        stack.extend(reversed(subdirs))
+    return hits
+
 def _find_gradlew() -> Optional[pathlib.Path]:
     direct = ROOT / "gradlew"
     if direct.exists(): return direct
-    for p in ROOT.glob("**/gradlew"):
-        return p
+    for d in _scan_android()["gradlew"]:
+        return pathlib.Path(d) / "gradlew"
     return None
 
 def _heuristic_build_cmd() -> str:
@@ -111,20 +255,22 @@ def _heuristic_build_cmd() -> str:
     if gw is None:
         return "./gradlew assembleDebug --stacktrace"
     # prefer module 'app' if present
-    app = list(ROOT.glob("**/app/build.gradle*"))
+    app = [d for d in _scan_android()["build_gradle"] if os.path.basename(d) == "app"]
     if app:
-        return f'cd {shlex.quote(str(app[0].parent))} && ./gradlew :app:assembleDebug --stacktrace'
+        return f'cd {shlex.quote(app[0])} && ./gradlew :app:assembleDebug --stacktrace'
     return f'cd {shlex.quote(str(gw.parent))} && ./gradlew assembleDebug --stacktrace'
 
 def _android_prompt_for_cmd() -> str:
-    tree = repo_tree()
+    # git index read, tree walk and log read are independent I/O; overlap them
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        f_tree, f_scan, f_tail = ex.submit(repo_tree), ex.submit(_scan_android), ex.submit(build_log_tail)
+        tree, scan, tail = f_tree.result(), f_scan.result(), f_tail.result()
     hints = {
         "has_gradlew": _find_gradlew() is not None,
-        "has_settings_gradle": any(ROOT.glob("**/settings.gradle*")),
-        "has_build_gradle": any(ROOT.glob("**/build.gradle*")),
-        "modules_guess": [p.parent.name for p in ROOT.glob("**/build.gradle*")][:20],
+        "has_settings_gradle": bool(scan["settings"]),
+        "has_build_gradle": bool(scan["build_gradle"]),
+        "modules_guess": [os.path.basename(d) for d in scan["build_gradle"]][:20],
     }
-    tail = build_log_tail()
     return f"""You are an Android CI assistant. Output ONLY the single best shell command to build an installable artifact.
 Rules:
 - If needed, prefix with: cd <dir> && ./gradlew <task> --stacktrace
@@ -142,19 +288,55 @@ Recent build.log tail (optional):
 {tail}
 """.strip()
 
-def derive_build_cmd(req_mod) -> str:
+_GRADLE_CMD_RE = re.compile(r'(?m)^\s*(cd\s+\S.*?\s*&&\s*)?(\.\/gradlew|\bgradlew\b)\s+\S.*$')
+
+def _parse_cmd(out: str) -> Optional[str]:
+    """First gradlew command line in a model reply, whitespace-collapsed."""
+    if not out or "gradlew" not in out:
+        return None
+    m = _GRADLE_CMD_RE.search(out)
+    return " ".join(m.group(0).split()) if m else None
+
+def _tree_sig() -> str:
+    """Cheap repo signature: tracked file list + gradlew location."""
+    return hashlib.sha256((repo_tree() + str(_find_gradlew())).encode("utf-8")).hexdigest()[:16]
+
+def _cached_build_cmd(sig: str) -> Optional[str]:
+    try:
+        data = json.loads(ANDROID_JSON.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if data.get("sig") == sig and data.get("build_cmd") and _find_gradlew():
+        return data["build_cmd"]
+    return None
+
+# gradle refusing the command itself (not a compile error) → derive a new one
+_CMD_REJECTED_RE = re.compile(r"(Task|Project) '[^']*' not found")
+
+def derive_build_cmd(req_mod, sig: str = "", force: bool = False) -> str:
     logs = []
+    # 0) Reuse the command from a previous run if the tree hasn't changed
+    if sig and not force:
+        cmd = _cached_build_cmd(sig)
+        if cmd:
+            append_android_log([f"[cmd] reusing cached command (sig {sig}): {cmd}"])
+            return cmd
+    prompt = _android_prompt_for_cmd()
+    # load the llama model while OpenAI is in flight so the fallback is warm
+    if hasattr(req_mod, "warm_llama"):
+        req_mod.warm_llama()
     # 1) OpenAI
     try:
         out = req_mod.request_ai(
             "Return ONLY the best Gradle command to build this Android project.",
-            context_parts=[_android_prompt_for_cmd()],
+            context_parts=[prompt],
             want_diff=False,
+            n=2,              # two candidates in one round trip
+            temperature=0.4,
         )
         if isinstance(out, tuple): out = out[0]
-        m = re.search(r'(^|\n)\s*(cd\s+[^\n]+?\s*&&\s*)?(\.\/gradlew|\bgradlew\b)\s+[^\n]+', out)
-        if m:
-            cmd = re.sub(r"\s+", " ", m.group(0).strip())
+        cmd = _parse_cmd(out)
+        if cmd:
             logs.append("[cmd] OpenAI proposed: " + cmd)
             append_android_log(logs)
             return cmd if "--stacktrace" in cmd else (cmd + " --stacktrace")
@@ -165,15 +347,14 @@ def derive_build_cmd(req_mod) -> str:
     try:
         out = req_mod.request_ai(
             "Return ONLY the best Gradle command to build this Android project.",
-            context_parts=[_android_prompt_for_cmd()],
+            context_parts=[prompt],
             want_diff=False,
             provider="llama",
             fallback_provider="none",
         )
         if isinstance(out, tuple): out = out[0]
-        m = re.search(r'(^|\n)\s*(cd\s+[^\n]+?\s*&&\s*)?(\.\/gradlew|\bgradlew\b)\s+[^\n]+', out)
-        if m:
-            cmd = re.sub(r"\s+", " ", m.group(0).strip())
+        cmd = _parse_cmd(out)
+        if cmd:
             logs.append("[cmd] llama proposed: " + cmd)
             append_android_log(logs)
             return cmd if "--stacktrace" in cmd else (cmd + " --stacktrace")
@@ -187,56 +368,165 @@ def derive_build_cmd(req_mod) -> str:
     return cmd
 
 # ---- run build and capture build.log ----
+_SHELL_META = set("|;<>$`*?&(){}\\\n")
+
+def _split_cmd(cmd: str):
+    """
+    'cd X && ./gradlew ...' -> (argv, cwd) so gradle can be exec'd directly.
+    Returns None when the command needs a real shell.
+    """
+    segs = [x.strip() for x in re.split(r"\s*&&\s*", cmd.strip())]
+    cwd = ROOT
+    if len(segs) == 2 and segs[0].startswith("cd "):
+        try:
+            cd = shlex.split(segs[0])
+        except ValueError:
+            return None
+        if len(cd) != 2:
+            return None
+        cwd = (ROOT / cd[1]).resolve()
+        segs = segs[1:]
+    if len(segs) != 1 or any(c in _SHELL_META for c in segs[0]):
+        return None
+    try:
+        argv = shlex.split(segs[0])
+    except ValueError:
+        return None
+    return (argv, cwd) if argv else None
+
+def _kill_group(proc: subprocess.Popen, timed_out: Optional[list] = None) -> None:
+    if timed_out is not None:
+        timed_out.append(True)
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
 def run_build(cmd: str) -> int:
+    sys.stdout.flush()
+    split = _split_cmd(cmd)
+    if split:
+        args, cwd, shell = split[0], split[1], False
+    else:
+        args, cwd, shell = cmd, ROOT, True
     with open(BUILD_LOG, "wb") as f:
-        proc = subprocess.Popen(cmd, cwd=str(ROOT), shell=True,
-                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            proc = subprocess.Popen(args, cwd=str(cwd), shell=shell, bufsize=0, start_new_session=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            # Direct exec of a missing/non-executable gradlew or cd target: report it
+            # like the shell would (exit 127) so the fix loop can act on the log.
+            msg = f"[AirysDark-AI] could not start build command {cmd!r}: {e}\n"
+            print(msg, end="")
+            f.write(msg.encode())
+            return 127
         assert proc.stdout
-        for line in proc.stdout:
-            sys.stdout.buffer.write(line)
-            f.write(line)
-        return proc.wait()
+        timer, timed_out = None, []
+        if AI_BUILD_TIMEOUT > 0:
+            timer = threading.Timer(AI_BUILD_TIMEOUT, _kill_group, (proc, timed_out))
+            timer.daemon = True
+            timer.start()
+        try:
+            # tee raw 64 KiB chunks to stdout + build.log (no per-line Python work)
+            fd = proc.stdout.fileno()
+            out_fd = sys.stdout.fileno()
+            while True:
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(out_fd, view):]
+                f.write(chunk)
+            rc = proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            if proc.poll() is None:
+                _kill_group(proc)
+                proc.wait()
+        if timed_out:
+            f.write(f"\n[AirysDark-AI] build killed after {AI_BUILD_TIMEOUT:g}s timeout\n".encode())
+        return rc
 
 # ---- ask AI for a unified diff fix ----
+def _diff_applies(diff_text: str) -> bool:
+    p = subprocess.run(["git", "apply", "--check", "-"], cwd=str(ROOT), input=diff_text, text=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return p.returncode == 0
+
 def ask_ai_for_fix(req_mod, build_cmd: str) -> Optional[str]:
     task = ("You are an automated build fixer working in a Git repository.\n"
             "Return ONLY a valid unified diff (---/+++ with @@ hunks) that minimally fixes the build.\n"
             "Keep edits small and safe; adjust Gradle/Kotlin/Android config only if necessary.")
+    # static blocks first (stable prompt prefix across attempts), log tail last
     context = [
         "## File list (truncated)\n" + repo_tree(),
         "## Recent git diff (truncated)\n" + recent_diff(),
         f"## Build command\n{build_cmd}",
-        f"## Build log tail (last {AI_LOG_TAIL} lines)\n{build_log_tail(AI_LOG_TAIL)}",
     ]
-    out_text, diff = req_mod.request_ai(
-        task, context_parts=context, want_diff=True,
+    dynamic = []
+    if _LAST_REJECT:
+        dynamic.append(f"## Previous diff rejected hunks\n{_LAST_REJECT}")
+    # newest block is never dropped when fitting the token budget
+    dynamic.append(f"## Build log tail (last {AI_LOG_TAIL} lines)\n{build_log_tail(AI_LOG_TAIL)}")
+    # speculative: several candidates in flight, keep the first one that applies cleanly
+    out_text, diff = "", None
+    first = None
+    for cand_text, cand_diff in req_mod.request_ai_many(
+        task, n=AI_FIX_CANDIDATES, context_parts=context, dynamic_parts=dynamic, want_diff=True,
         system="You are a precise CI fixer. Output only a unified diff when asked for code changes."
-    )
+    ):
+        if first is None or (cand_diff and not first[1]):
+            first = (cand_text, cand_diff)
+        if cand_diff and _diff_applies(cand_diff):
+            out_text, diff = cand_text, cand_diff
+            break
+    else:
+        if first:
+            out_text, diff = first
     # save raw answer for debugging
     try: AI_OUT_TXT.write_text(out_text or "", encoding="utf-8")
     except Exception: pass
     if diff: return diff
     # last chance: try extracting by regex if provider didn’t
-    from AirysDark-AI_Request import extract_unified_diff as _extract  # safe import name
-    return _extract(out_text or "")
+    return req_mod.extract_unified_diff(out_text or "")
+
+def _git_apply(args: List[str], diff_text: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", "apply", *args, "-"], cwd=str(ROOT), input=diff_text, text=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
 def apply_patch(diff_text: str) -> bool:
+    global _LAST_REJECT
+    _LAST_REJECT = ""
     PATCH_SNAPSHOT.write_text(diff_text, encoding="utf-8")
-    with tempfile.NamedTemporaryFile("w", delete=False, suffix=".patch") as tmp:
-        tmp.write(diff_text)
-        tmp_path = tmp.name
-    try:
-        sh("git add -A || true")
-        sh(f"git apply --reject --whitespace=fix {tmp_path} || true")
-        chg = sh("git status --porcelain")
-        return bool(chg.strip())
-    finally:
-        try: os.unlink(tmp_path)
-        except Exception: pass
+    # dry-run first: a diff that doesn't apply never touches the worktree (no .rej churn)
+    chk = _git_apply(["--check"], diff_text)
+    if chk.returncode != 0:
+        chk3 = _git_apply(["--check", "--3way"], diff_text)
+        if chk3.returncode != 0:
+            _LAST_REJECT = (chk.stdout or chk3.stdout or "").strip()
+            return False
+    sh("git add -A || true")
+    before = sh("git write-tree").strip()  # index == worktree here
+    res = _git_apply(["--index", "--3way", "--whitespace=fix"], diff_text)
+    _scan_android.cache_clear()
+    conflicted = sh("git diff --name-only --diff-filter=U").split()
+    if conflicted:
+        # hand the conflict markers to the next AI prompt, then undo the whole
+        # apply so they never reach the worktree (or the PR)
+        _LAST_REJECT = sh("git diff -- " + " ".join(shlex.quote(c) for c in conflicted))
+        sh(f"git read-tree --reset -u {before}")
+        return False
+    elif res.returncode != 0:
+        _LAST_REJECT = (res.stdout or "").strip()
+    chg = sh("git status --porcelain")
+    return bool(chg.strip())
 
 # ---- generate/update final Android workflow (no builder step here) ----
-def write_android_workflow(build_cmd: str):
-    yml = f"""
+# The workflow does not depend on build_cmd (the loop re-derives it on the
+# runner), so the f-string's brace escapes are rendered once at import.
+_ANDROID_WF_YML = f"""
 name: AirysDark-AI - Android (generated)
 
 on:
@@ -292,8 +582,8 @@ jobs:
         run: |
           set -euxo pipefail
           python3 tools/AirysDark-AI_android.py --mode run | tee /tmp/android.out
-          if grep -q '^BUILD_CMD=' /tmp/android.out; then
-            CMD=$(grep -E '^BUILD_CMD=' /tmp/android.out | sed 's/^BUILD_CMD=//')
+          CMD=$(sed -n 's/^BUILD_CMD=//p' /tmp/android.out | tail -n 1)
+          if [ -n "$CMD" ]; then
             echo "BUILD_CMD=$CMD" >> "$GITHUB_OUTPUT"
           fi
 
@@ -348,9 +638,10 @@ jobs:
             - Build command: ${{{{ steps.run.outputs.BUILD_CMD }}}}
             - Logs: see artifact "android-ai-loop"
           labels: automation, ci
-""".lstrip("\n")
-    # double-brace escaping already handled
-    (WF / "AirysDark-AI_android.yml").write_text(yml, encoding="utf-8")
+""".lstrip("\n").encode("utf-8")
+
+def write_android_workflow(build_cmd: str):
+    write_if_changed(WF / "AirysDark-AI_android.yml", _ANDROID_WF_YML)
 
 # ---- main loop ----
 def main_loop() -> int:
@@ -358,8 +649,9 @@ def main_loop() -> int:
     req = _load_requester()
 
     # 0) Choose/remember build command
-    build_cmd = derive_build_cmd(req)
-    ANDROID_JSON.write_text(json.dumps({"build_cmd": build_cmd}, indent=2), encoding="utf-8")
+    sig = _tree_sig()
+    build_cmd = derive_build_cmd(req, sig)
+    write_if_changed(ANDROID_JSON, json.dumps({"build_cmd": build_cmd, "sig": sig}, indent=2))
     append_android_log([f"[run] using build_cmd: {build_cmd}"])
     print(f"BUILD_CMD={build_cmd}")
 
@@ -367,6 +659,7 @@ def main_loop() -> int:
     write_android_workflow(build_cmd)
 
     # 2) Try build → if fail → AI-fix loop
+    rederived = False
     for attempt in range(1, MAX_FIX_ATTEMPTS + 1):
         append_android_log([f"[attempt] build try {attempt}/{MAX_FIX_ATTEMPTS}"])
         code = run_build(build_cmd)
@@ -374,6 +667,18 @@ def main_loop() -> int:
             append_android_log(["[result] build OK"])
             return 0
 
+        if not rederived and _CMD_REJECTED_RE.search(build_log_tail()):
+            # the cached/derived command itself is wrong; pick a new one once
+            rederived = True
+            new_cmd = derive_build_cmd(req, sig, force=True)
+            if new_cmd != build_cmd:
+                build_cmd = new_cmd
+                append_android_log([f"[cmd] gradle rejected the command; now using: {build_cmd}"])
+                write_if_changed(ANDROID_JSON, json.dumps({"build_cmd": build_cmd, "sig": sig}, indent=2))
+                print(f"BUILD_CMD={build_cmd}")
+                write_android_workflow(build_cmd)
+                continue
+
         append_android_log([f"[result] build failed (code {code}); asking AI for diff..."])
         diff = ask_ai_for_fix(req, build_cmd)
         if not diff:
@@ -7,8 +7,15 @@
 # - OpenAI → llama.cpp fallback
 # - Log/artifacts + allow/deny globs + dangerous file guard
 
-import os, sys, re, json, pathlib, subprocess, tempfile, shlex, datetime, hashlib
-from typing import Optional, Tuple, List, Dict, Any
+import os, sys, re, json, mmap, fnmatch, pathlib, subprocess, datetime, hashlib
+from itertools import islice
+from collections import Counter, defaultdict
+from typing import Optional, Tuple, List, Dict, Any, NamedTuple
+
+try:
+    import pathspec  # optional: honour .gitignore when sampling the tree
+except Exception:
+    pathspec = None
 
 ROOT = pathlib.Path(os.getenv("PROJECT_ROOT", ".")).resolve()
 TOOLS = ROOT / "tools"
@@ -20,7 +27,7 @@ PROVIDER = os.getenv("PROVIDER", "openai")            # openai | llama
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 FALLBACK_PROVIDER = os.getenv("FALLBACK_PROVIDER", "llama")
 LLAMA_CPP_BIN = os.getenv("LLAMA_CPP_BIN", "llama-cli")
-LLAMA_MODEL_PATH = pathlib.Path(os.getenv("MODEL_PATH", "models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"))
+LLAMA_MODEL_PATH = pathlib.Path(os.getenv("MODEL_PATH", "models/tinyllama-1.1b-chat-v1.0.Q4_0.gguf"))
 LLAMA_CTX = int(os.getenv("LLAMA_CTX", "4096"))
 
 # Prompt/context sizing
@@ -31,10 +38,14 @@ LOG_TAIL_LINES    = int(os.getenv("AI_LOG_TAIL", "160"))
 
 # Build
 BUILD_CMD = os.getenv("BUILD_CMD", "./gradlew assembleDebug --stacktrace")
+GRADLE_CONFIG_CACHE = os.getenv("AI_GRADLE_CONFIG_CACHE", "1") == "1"   # set 0 for Gradle < 6.6
 
 # Edit constraints
 ALLOWLIST_GLOBS = [g for g in os.getenv("ALLOWLIST_GLOBS", "").split(",") if g.strip()]
 DENYLIST_GLOBS  = [g for g in os.getenv("DENYLIST_GLOBS", "").split(",") if g.strip()]
+# each glob list compiled into one regex union (fnmatch semantics)
+_ALLOW_RE = re.compile("|".join(fnmatch.translate(g.strip()) for g in ALLOWLIST_GLOBS)) if ALLOWLIST_GLOBS else None
+_DENY_RE  = re.compile("|".join(fnmatch.translate(g.strip()) for g in DENYLIST_GLOBS)) if DENYLIST_GLOBS else None
 
 # Files / artifacts
 BUILD_LOG = ROOT / "build.log"
@@ -47,6 +58,7 @@ DANGEROUS_PATH_HINTS = [
     ".git/",
     "secrets.", "keystore", "gradle.properties", "local.properties",
 ]
+_RE_DANGEROUS = re.compile("|".join(re.escape(h) for h in DANGEROUS_PATH_HINTS), re.I)
 
 PROMPT = """You are an automated build fixer working inside a Git repository.
 
@@ -77,129 +89,230 @@ Constraints:
 If editing build systems, keep them consistent (e.g., Gradle plugin & Kotlin versions).
 """
 
+# Compiled once; these run over every log line / diff file header.
+_RE_REDACT_KEY  = re.compile(r'\b(?:AKIA|ASIA|SK|GH|GHO|ghp_)\w{16,}')
+_RE_REDACT_KV   = re.compile(r'(?i)(api[-_ ]?key|token|secret)\s*[:=]\s*\S+')
+_RE_DIFF_HEADER = re.compile(r'(?m)^---\s')
+_RE_DIFF_SPLIT  = re.compile(r'(?m)(?=^---\s)')
+_RE_DIFF_FILE   = re.compile(r'^\+\+\+\s+(?:b/)?(.+)$', re.M)
+_RE_PATH        = re.compile(r'/[^\s:]+(\.\w+)+')
+_RE_LINECOL     = re.compile(r'\b\d{1,4}[:;,.]\d{1,4}\b')
+_RE_NUM         = re.compile(r'\b\d+\b')
+_RE_FAILKW      = re.compile(r'failed|error|exception|could not|not found|undefined|unresolved', re.I)
+
 # ---------------- helpers ----------------
 
 def run(cmd, cwd=ROOT, capture=False, check=False, env=None):
+    # argv lists are exec'd directly; only plain strings go through /bin/sh
+    shell = isinstance(cmd, str)
     if capture:
-        p = subprocess.run(cmd, cwd=cwd, shell=True, text=True,
+        p = subprocess.run(cmd, cwd=cwd, shell=shell, text=True,
                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
         if check and p.returncode != 0:
             raise subprocess.CalledProcessError(p.returncode, cmd, p.stdout)
         return p
     else:
-        return subprocess.run(cmd, cwd=cwd, shell=True, env=env, check=check)
+        return subprocess.run(cmd, cwd=cwd, shell=shell, env=env, check=check)
 
 def git(*args, capture=False):
-    return run("git " + " ".join(shlex.quote(a) for a in args), capture=capture)
+    return run(["git", *args], capture=capture)
 
 def ensure_git_repo():
     if not (ROOT / ".git").exists():
-        run('git init')
-        run('git config user.name "airysdark-ai"')
-        run('git config user.email "airysdark-ai@local"')
+        git("init")
+        git("config", "user.name", "airysdark-ai")
+        git("config", "user.email", "airysdark-ai@local")
         git("add", "-A")
-        run('git commit -m "AI: initial snapshot" || true')
+        git("commit", "-m", "AI: initial snapshot")
+
+SKIP_DIRS = {".git", ".gradle", ".idea", "build", "node_modules", "__pycache__"}
+
+def _gitignore_spec():
+    gi = ROOT / ".gitignore"
+    if pathspec is None or not gi.exists():
+        return None
+    return pathspec.PathSpec.from_lines("gitwildmatch", gi.read_text(errors="ignore").splitlines())
+
+def _iter_git_ls_files():
+    """Tracked paths streamed from `git ls-files`; the process is killed as soon as
+    the caller stops reading. None if git can't be started."""
+    try:
+        p = subprocess.Popen(["git", "-c", "core.quotePath=off", "ls-files"], cwd=ROOT, text=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+
+    def lines():
+        try:
+            for ln in p.stdout:
+                yield ln.rstrip("\n")
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.wait()
+            p.stdout.close()
+    return lines()
+
+def iter_repo_files():
+    """Relative paths for the prompt's tree sample, lazily (stops when the caller does).
+
+    Without pathspec the walk can't honour .gitignore, so tracked files come from
+    `git ls-files` instead (build.log, patches, models stay out of the prompt).
+    """
+    spec = _gitignore_spec()
+    if spec is None and (ROOT / ".git").exists():
+        tracked = _iter_git_ls_files()
+        if tracked is not None:
+            yield from tracked
+            return
+    for dirpath, dirnames, filenames in os.walk(ROOT):
+        rel_dir = os.path.relpath(dirpath, ROOT)
+        prefix = "" if rel_dir == "." else rel_dir.replace(os.sep, "/") + "/"
+        dirnames[:] = sorted(d for d in dirnames
+                             if d not in SKIP_DIRS and not (spec and spec.match_file(prefix + d + "/")))
+        for name in sorted(filenames):
+            if spec is None or not spec.match_file(prefix + name):
+                yield prefix + name
 
 def repo_tree(limit=REPO_TREE_LIMIT):
-    out = run("git ls-files || true", capture=True).stdout.splitlines()
-    return "\n".join(out[:limit])
+    files = iter_repo_files()
+    try:
+        return "\n".join(islice(files, limit))
+    finally:
+        files.close()  # stops a streaming `git ls-files` right away
 
 def recent_diff(limit_chars=DIFF_CHAR_LIMIT):
-    out = run("git log --oneline -n 1 || true", capture=True).stdout.strip()
+    out = git("log", "--oneline", "-n", "1", capture=True).stdout.strip()
     if not out:
         return "(no recent commits)"
-    diff = run("git diff --unified=2 -M -C HEAD~5..HEAD || true", capture=True).stdout
-    return diff[-limit_chars:]
+    # keep git's output as bytes and decode only the kept tail (the diff can be MBs)
+    diff = subprocess.run(["git", "diff", "--unified=2", "-M", "-C", "HEAD~5..HEAD"], cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    return bytes(memoryview(diff)[-limit_chars:]).decode("utf-8", "ignore")
 
 def log_tail(lines=LOG_TAIL_LINES):
     if not BUILD_LOG.exists():
         return "(no build log)"
-    return "\n".join(BUILD_LOG.read_text(errors="ignore").splitlines()[-lines:])
+    with open(BUILD_LOG, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        # mmap + reverse newline scan: touches only the tail pages of huge logs
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = len(mm)
+            for _ in range(lines + 1):  # +1: the file usually ends with a newline
+                pos = mm.rfind(b"\n", 0, pos)
+                if pos < 0:
+                    break
+            tail = mm[pos + 1:]
+    return "\n".join(tail.decode("utf-8", "ignore").splitlines()[-lines:])
 
 def redact(text: str) -> str:
-    text = re.sub(r'(?:AKIA|ASIA|SK|GH|GHO|ghp_)\\w+', '***REDACTED***', text)
-    text = re.sub(r'(?i)(api[-_ ]?key|token|secret)\\s*[:=]\\s*\\S+', '\\1: ***REDACTED***', text)
+    text = _RE_REDACT_KEY.sub('***REDACTED***', text)
+    text = _RE_REDACT_KV.sub(r'\1: ***REDACTED***', text)
     return text
 
 def truncate_for_tokens(s: str, max_tokens=MAX_PROMPT_TOKENS):
     char_limit = max_tokens * 4
     if len(s) <= char_limit:
         return s
-    head = s[: int(char_limit * 0.60)]
-    tail = s[- int(char_limit * 0.35):]
-    return head + "\n\n[...truncated...]\n\n" + tail
+    # str slices only copy the kept head/tail, never the whole input
+    return "".join((s[: int(char_limit * 0.60)], "\n\n[...truncated...]\n\n", s[- int(char_limit * 0.35):]))
+
+def gradle_fast_cmd(cmd: str) -> str:
+    """Use every runner core and reuse build/configuration caches across attempts."""
+    if "gradlew" not in cmd or "--parallel" in cmd:
+        return cmd
+    cmd += f" --parallel --max-workers={os.cpu_count() or 2} --build-cache"
+    if GRADLE_CONFIG_CACHE and "configuration-cache" not in cmd:
+        # warn: an incompatible plugin must not turn into a "build failure" for the AI to fix
+        cmd += " --configuration-cache --configuration-cache-problems=warn"
+    return cmd
 
 def build_once():
-    with open(BUILD_LOG, "wb") as f:
-        p = subprocess.Popen(BUILD_CMD, cwd=ROOT, shell=True,
+    sys.stdout.flush()
+    with open(BUILD_LOG, "wb", buffering=1 << 20) as f:
+        p = subprocess.Popen(BUILD_CMD, cwd=ROOT, shell=True, bufsize=0,
                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        for line in p.stdout:
-            sys.stdout.buffer.write(line)
-            f.write(line)
+        # tee raw 64 KiB chunks instead of line-by-line: O(chunks) syscalls
+        fd, out_fd = p.stdout.fileno(), sys.stdout.fileno()
+        while True:
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                break
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(out_fd, view):]
+            f.write(chunk)
     return p.wait()
 
 def extract_unified_diff(text: str) -> Optional[str]:
-    m = re.search(r'(?ms)^---\\s', text or "")
+    m = _RE_DIFF_HEADER.search(text or "")
     return text[m.start():].strip() if m else None
 
 def diff_touches_dangerous_paths(diff_text: str) -> bool:
-    lower = diff_text.lower()
-    for hint in DANGEROUS_PATH_HINTS:
-        if hint in lower:
-            if not ALLOWLIST_GLOBS:
-                return True
-    return False
+    # one case-insensitive scan; no lowered copy of the diff
+    return not ALLOWLIST_GLOBS and _RE_DANGEROUS.search(diff_text) is not None
+
+class DiffInfo(NamedTuple):
+    files: List[str]
+    size_bytes: int
+    dangerous: bool
+
+def analyze_diff(diff_text: str) -> DiffInfo:
+    """File list, UTF-8 size and dangerous-path flag, computed once per diff."""
+    files = [m.group(1) for m in _RE_DIFF_FILE.finditer(diff_text)]
+    size = len(diff_text) if diff_text.isascii() else len(diff_text.encode("utf-8"))
+    return DiffInfo(files, size, diff_touches_dangerous_paths(diff_text))
 
 def path_allowed_by_globs(filepath: str) -> bool:
-    if ALLOWLIST_GLOBS:
-        import fnmatch
-        if not any(fnmatch.fnmatch(filepath, g.strip()) for g in ALLOWLIST_GLOBS):
-            return False
-    if DENYLIST_GLOBS:
-        import fnmatch
-        if any(fnmatch.fnmatch(filepath, g.strip()) for g in DENYLIST_GLOBS):
-            return False
+    if _ALLOW_RE and not _ALLOW_RE.match(filepath):
+        return False
+    if _DENY_RE and _DENY_RE.match(filepath):
+        return False
     return True
 
 def filter_diff_by_globs(diff_text: str) -> str:
     # split on file boundaries and keep allowed files
-    chunks = re.split(r'(?m)(?=^---\\s)', diff_text)
+    chunks = _RE_DIFF_SPLIT.split(diff_text)
     kept = []
     for ch in chunks:
         if not ch.strip():
             continue
-        m = re.search(r'^\\+\\+\\+\\s+(?:b/)?(.+)$', ch, flags=re.M)
+        m = _RE_DIFF_FILE.search(ch)
         path = m.group(1).strip() if m else ""
         if path and path_allowed_by_globs(path):
             kept.append(ch)
     return "".join(kept) if kept else ""
 
+def git_stdin(args: List[str], data: str) -> subprocess.CompletedProcess:
+    """Run git with data on stdin (patches never touch a tempfile)."""
+    return subprocess.run(["git", *args], cwd=ROOT, input=data, text=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
 def apply_patch(diff_text: str) -> Tuple[bool, str]:
-    tmp = tempfile.NamedTemporaryFile("w", delete=False, suffix=".patch")
-    tmp.write(diff_text)
-    tmp.close()
-    try:
-        git("add", "-A")
-        run(f"git diff --staged > {shlex.quote(str(PATCH_SNAPSHOT))} || true")
-        r = run(f"git apply --reject --whitespace=fix {shlex.quote(tmp.name)}", capture=True)
-        if r.returncode != 0:
-            r2 = run(f"git apply --3way --reject --whitespace=fix {shlex.quote(tmp.name)}", capture=True)
-            if r2.returncode != 0:
-                return False, r2.stdout
-        git("add", "-A")
-        run('git commit -m "AI: apply automatic fix" || true')
-        return True, "applied"
-    finally:
-        os.unlink(tmp.name)
+    # dry-run first: an unapplicable diff costs one git call, no snapshot
+    chk = git_stdin(["apply", "--check", "-"], diff_text)
+    if chk.returncode != 0:
+        chk3 = git_stdin(["apply", "--check", "--3way", "-"], diff_text)
+        if chk3.returncode != 0:
+            return False, chk.stdout
+    # snapshot tracked changes vs HEAD; no 'add -A', which would hash every build artifact
+    with open(PATCH_SNAPSHOT, "wb") as snap:
+        subprocess.run(["git", "diff", "HEAD", "--", "."], cwd=ROOT, stdout=snap)
+    r = git_stdin(["apply", "--reject", "--whitespace=fix", "-"], diff_text)
+    if r.returncode != 0:
+        r2 = git_stdin(["apply", "--3way", "--reject", "--whitespace=fix", "-"], diff_text)
+        if r2.returncode != 0:
+            return False, r2.stdout
+    git("add", "-A")
+    git("commit", "-m", "AI: apply automatic fix")
+    return True, "applied"
 
 def compare_fail_signal(before_log: str, after_log: str) -> int:
     """Lower is better (fewer obvious failures)."""
     def score(t: str) -> int:
-        t = t.lower()
-        s = 0
-        for kw in ["failed", "error", "exception", "could not", "not found", "undefined", "unresolved"]:
-            s += t.count(kw)
-        return s
+        # one case-insensitive pass instead of lower() + a count() per keyword
+        return sum(1 for _ in _RE_FAILKW.finditer(t))
     return score(after_log) - score(before_log)
 
 # ---------------- self-teaching KB ----------------
@@ -207,18 +320,25 @@ def compare_fail_signal(before_log: str, after_log: str) -> int:
 def norm_line(s: str) -> str:
     s = s.strip()
     # remove timestamps, file paths line numbers, etc
-    s = re.sub(r"/[^\\s:]+(\\.\\w+)+", "<PATH>", s)
-    s = re.sub(r"\\b\\d{1,4}[:;,.]\\d{1,4}\\b", "<NUM>", s)
-    s = re.sub(r"\\b\\d+\\b", "<NUM>", s)
+    s = _RE_PATH.sub("<PATH>", s)
+    s = _RE_LINECOL.sub("<NUM>", s)
+    s = _RE_NUM.sub("<NUM>", s)
     return s
 
 def build_error_signature(text: str, max_lines: int = 30) -> Dict[str, Any]:
-    lines = [norm_line(x) for x in (text or "").splitlines() if x.strip()]
-    # take final N lines where errors usually summarize
-    tail = lines[-max_lines:]
-    sig_text = "\n".join(tail)
-    h = hashlib.sha256(sig_text.encode("utf-8")).hexdigest()[:16]
-    return {"hash": h, "preview": "\n".join(tail[:12])}
+    # take final N non-blank lines where errors usually summarize; walk back
+    # from the end so only those lines get normalized
+    tail: List[str] = []
+    for x in reversed((text or "").splitlines()):
+        if x.strip():
+            tail.append(norm_line(x))
+            if len(tail) == max_lines:
+                break
+    tail.reverse()
+    h = hashlib.sha256()
+    for i, ln in enumerate(tail):
+        h.update((ln if i == 0 else "\n" + ln).encode("utf-8"))
+    return {"hash": h.hexdigest()[:16], "preview": "\n".join(tail[:12])}
 
 def kb_load() -> List[Dict[str, Any]]:
     KB_DIR.mkdir(parents=True, exist_ok=True)
@@ -236,43 +356,84 @@ def kb_load() -> List[Dict[str, Any]]:
                 pass
     return out
 
+KB_COMPACT_BYTES = 4_000_000  # trim to the last 500 entries once the JSONL grows past this
+
+def _kb_line(e: Dict[str, Any]) -> str:
+    return json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n"
+
 def kb_save(entries: List[Dict[str, Any]]) -> None:
     KB_DIR.mkdir(parents=True, exist_ok=True)
     with KB_FILE.open("w", encoding="utf-8") as f:
         for e in entries[-500:]:  # keep last 500
-            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.write(_kb_line(e))
 
-def kb_find_candidate(sig: Dict[str, Any], entries: List[Dict, ]) -> Optional[Dict[str, Any]]:
+def kb_append(entry: Dict[str, Any]) -> None:
+    """O(1) insert; the full rewrite in kb_save only runs as occasional compaction."""
+    KB_DIR.mkdir(parents=True, exist_ok=True)
+    with KB_FILE.open("a", encoding="utf-8") as f:
+        f.write(_kb_line(entry))
+    if KB_FILE.stat().st_size > KB_COMPACT_BYTES:
+        kb_save(kb_load())
+
+def kb_index(entries: List[Dict[str, Any]]) -> Tuple[Dict[str, int], Dict[str, List[int]]]:
+    """sig.hash -> latest entry index, and preview token -> entry indices (inverted index)."""
+    by_hash: Dict[str, int] = {}
+    inverted: Dict[str, List[int]] = defaultdict(list)
+    for i, e in enumerate(entries):
+        sig = e.get("sig", {})
+        if sig.get("hash"):
+            by_hash[sig["hash"]] = i  # later entries win, like the old reversed scan
+        for tok in set((sig.get("preview") or "").lower().split()):
+            inverted[tok].append(i)
+    return by_hash, inverted
+
+_KB_INDEXED = None  # ((mtime_ns, size) of KB_FILE, entries, kb_index(entries))
+
+def kb_load_indexed() -> Tuple[List[Dict[str, Any]], Tuple[Dict[str, int], Dict[str, List[int]]]]:
+    """kb_load() plus its kb_index(), built once and reused until KB_FILE changes."""
+    global _KB_INDEXED
+    try:
+        st = KB_FILE.stat()
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    if _KB_INDEXED is None or _KB_INDEXED[0] != key:
+        entries = kb_load()
+        _KB_INDEXED = (key, entries, kb_index(entries))
+    return _KB_INDEXED[1], _KB_INDEXED[2]
+
+def kb_find_candidate(sig: Dict[str, Any], entries: List[Dict, ],
+                      index: Optional[Tuple[Dict[str, int], Dict[str, List[int]]]] = None) -> Optional[Dict[str, Any]]:
+    by_hash, inverted = index or kb_index(entries)
     # simple match by hash; if not found, try fuzzy contains in preview
-    for e in reversed(entries):
-        if e.get("sig", {}).get("hash") == sig.get("hash"):
-            return e
-    # fuzzy: overlap some tokens from preview
+    i = by_hash.get(sig.get("hash"))
+    if i is not None:
+        return entries[i]
+    # fuzzy: overlap some tokens from preview, counted via posting lists
     want = set((sig.get("preview") or "").lower().split())
     if not want:
         return None
-    best = None
-    best_score = 0
-    for e in reversed(entries):
-        got = set((e.get("sig", {}).get("preview") or "").lower().split())
-        score = len(want & got)
-        if score > best_score and score >= 6:
-            best = e; best_score = score
-    return best
-
-def diff_is_small_and_safe(diff_text: str, max_bytes=120_000, max_files=12) -> bool:
-    if len(diff_text.encode("utf-8")) > max_bytes:
+    hits = Counter(i for tok in want for i in inverted.get(tok, ()))
+    if not hits:
+        return None
+    # highest overlap, newest entry on ties
+    best_score, best = max((score, i) for i, score in hits.items())
+    return entries[best] if best_score >= 6 else None
+
+def diff_is_small_and_safe(diff_text: str, max_bytes=120_000, max_files=12,
+                           info: Optional[DiffInfo] = None) -> bool:
+    info = info or analyze_diff(diff_text)
+    if info.size_bytes > max_bytes:
         return False
-    if diff_touches_dangerous_paths(diff_text):
+    if info.dangerous:
         return False
-    files = re.findall(r'^\\+\\+\\+\\s+(?:b/)?(.+)$', diff_text, re.M)
-    if len(files) > max_files:
+    if len(info.files) > max_files:
         return False
     return True
 
 def kb_try_apply(sig: Dict[str, Any]) -> bool:
-    entries = kb_load()
-    cand = kb_find_candidate(sig, entries)
+    entries, index = kb_load_indexed()
+    cand = kb_find_candidate(sig, entries, index)
     if not cand:
         return False
     diff = cand.get("diff", "")
@@ -282,19 +443,21 @@ def kb_try_apply(sig: Dict[str, Any]) -> bool:
     ok, _ = apply_patch(diff)
     return ok
 
-def kb_learn(sig: Dict[str, Any], diff: str, project_type: Optional[str] = None) -> None:
-    if not diff or not diff_is_small_and_safe(diff):
+def kb_learn(sig: Dict[str, Any], diff: str, project_type: Optional[str] = None,
+             info: Optional[DiffInfo] = None) -> None:
+    if not diff:
+        return
+    info = info or analyze_diff(diff)
+    if not diff_is_small_and_safe(diff, info=info):
         return
-    entries = kb_load()
     eid = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + "-" + sig["hash"]
     meta = {
         "when": datetime.datetime.utcnow().isoformat() + "Z",
         "project_type": project_type or "",
-        "files": re.findall(r'^\\+\\+\\+\\s+(?:b/)?(.+)$', diff, re.M),
-        "size_bytes": len(diff.encode("utf-8")),
+        "files": info.files,
+        "size_bytes": info.size_bytes,
     }
-    entries.append({"id": eid, "sig": sig, "diff": diff, "meta": meta})
-    kb_save(entries)
+    kb_append({"id": eid, "sig": sig, "diff": diff, "meta": meta})
     # leave a short breadcrumb for humans
     note = TOOLS / "ai_kb" / f"learned_{eid}.txt"
     note.write_text(
@@ -304,28 +467,45 @@ def kb_learn(sig: Dict[str, Any], diff: str, project_type: Optional[str] = None)
 
 # ---------------- LLM providers ----------------
 
-def _call_openai(prompt):
-    key = os.environ.get("OPENAI_API_KEY")
-    if not key:
-        raise RuntimeError("openai_error: missing OPENAI_API_KEY")
-    import requests
-    url = "https://api.openai.com/v1/chat/completions"
-    payload = {"model": OPENAI_MODEL, "messages": [{"role": "user", "content": prompt}], "temperature": 0.2}
-    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json=payload, timeout=180)
-    if r.status_code >= 400:
+_REQUESTER = None  # AirysDark-AI_Request module once loaded; False if unavailable
+
+def _requester():
+    """Load AirysDark-AI_Request.py from this tools dir, so LLM calls share its
+    keep-alive OpenAI client and single warm llama-server (same port and pid
+    file) instead of second copies. Without it only llama-cli is available."""
+    global _REQUESTER
+    if _REQUESTER is None:
+        _REQUESTER = False
+        path = pathlib.Path(__file__).resolve().parent / "AirysDark-AI_Request.py"
         try:
-            err = r.json()
-        except Exception:
-            err = {"raw": r.text}
-        raise RuntimeError("openai_error:" + json.dumps(err))
-    data = r.json()
-    return data["choices"][0]["message"]["content"]
+            import importlib.util
+            spec = importlib.util.spec_from_file_location("airysdark_ai_request", str(path))
+            mod = importlib.util.module_from_spec(spec)  # type: ignore
+            spec.loader.exec_module(mod)  # type: ignore
+            _REQUESTER = mod
+        except Exception as e:
+            print("⚠️ AirysDark-AI_Request.py unavailable; only llama-cli can be used:", e)
+    return _REQUESTER or None
+
+def _call_openai(prompt):
+    rq = _requester()
+    if rq is None:
+        raise RuntimeError("openai_error: AirysDark-AI_Request.py unavailable")
+    try:
+        return rq.openai_complete(prompt, temperature=0.2)
+    except RuntimeError as e:
+        raise RuntimeError("openai_error:" + str(e)[:500])
 
 def _call_llama(prompt):
     if not LLAMA_MODEL_PATH.exists():
         raise RuntimeError(f"llama_error: model missing at {LLAMA_MODEL_PATH}")
     safe = truncate_for_tokens(prompt, MAX_PROMPT_TOKENS)
+    rq = _requester()
+    if rq is not None:
+        try:
+            return rq.llama_complete(safe, 0.2)
+        except RuntimeError as e:
+            raise RuntimeError("llama_error:" + str(e)[:500])
     cmd = [LLAMA_CPP_BIN, "-m", str(LLAMA_MODEL_PATH), "-p", safe, "-n", "2048", "--temp", "0.2", "-c", str(LLAMA_CTX)]
     out = subprocess.run(cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     if out.returncode != 0:
@@ -349,6 +529,8 @@ def call_llm(prompt):
 # ---------------- main ----------------
 
 def main():
+    global BUILD_CMD
+    BUILD_CMD = gradle_fast_cmd(BUILD_CMD)
     TOOLS.mkdir(parents=True, exist_ok=True)
     KB_DIR.mkdir(parents=True, exist_ok=True)
     ensure_git_repo()
@@ -378,16 +560,25 @@ def main():
             # keep the change (might be partial), proceed
 
     # 1..N attempts with LLM
+    # tree + recent diff are fetched, truncated and redacted once; only the
+    # build log changes between attempts, and it gets whatever budget is left
+    tree_txt = redact(truncate_for_tokens(repo_tree()))
+    diff_txt = redact(truncate_for_tokens(recent_diff()))
+    char_limit = MAX_PROMPT_TOKENS * 4
+    fixed_len = len(PROMPT.format(repo_tree=tree_txt, recent_diff=diff_txt, build_cmd=BUILD_CMD,
+                                  log_tail=LOG_TAIL_LINES, build_tail=""))
+    tail_tokens = max(char_limit - fixed_len, char_limit // 4) // 4
     for attempt in range(1, ATTEMPTS + 1):
         print(f"\n== Attempt {attempt}/{ATTEMPTS} ==")
         ctx = PROMPT.format(
-            repo_tree=redact(truncate_for_tokens(repo_tree())),
-            recent_diff=redact(truncate_for_tokens(recent_diff())),
+            repo_tree=tree_txt,
+            recent_diff=diff_txt,
             build_cmd=BUILD_CMD,
             log_tail=LOG_TAIL_LINES,
-            build_tail=redact(truncate_for_tokens(log_tail())),
+            build_tail=redact(truncate_for_tokens(log_tail(), tail_tokens)),
         )
-        ctx = truncate_for_tokens(ctx)
+        if len(ctx) > char_limit:  # only when tree + diff alone blow the budget
+            ctx = truncate_for_tokens(ctx)
 
         try:
             raw = call_llm(ctx)
@@ -400,7 +591,8 @@ def main():
             print("LLM did not return a unified diff. Stopping.")
             return 1
 
-        if diff_touches_dangerous_paths(diff):
+        info = analyze_diff(diff)
+        if info.dangerous:
             print("⚠️ Proposed diff touches restricted paths; rejecting.")
             return 1
 
@@ -410,6 +602,7 @@ def main():
                 print("⚠️ Diff removed by globs; nothing to apply.")
                 return 1
             diff = filtered
+            info = analyze_diff(diff)
 
         ok, why = apply_patch(diff)
         with open(AI_ATTEMPTS_LOG, "a", encoding="utf-8") as jf:
@@ -433,7 +626,7 @@ def main():
             print("✅ Build fixed!")
             AI_SUMMARY.write_text(f"Build fixed on attempt {attempt}\n", encoding="utf-8")
             # learn the fix
-            kb_learn(base_sig, diff, project_type=os.getenv("TARGET", ""))
+            kb_learn(base_sig, diff, project_type=os.getenv("TARGET", ""), info=info)
             return 0
         else:
             if delta > 0:
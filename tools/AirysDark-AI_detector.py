@@ -13,11 +13,21 @@
 
 import os
 import json
+import hashlib
 import pathlib
 import textwrap
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+try:
+    import orjson  # optional: much faster indented dumps
+except Exception:
+    orjson = None  # type: ignore
 
 ROOT = pathlib.Path(os.getenv("PROJECT_DIR", ".")).resolve()
+# ROOT with exactly one trailing separator ("/" stays "/"); relative paths are
+# sliced off / concatenated onto this instead of going through pathlib.
+ROOT_PREFIX = os.path.join(str(ROOT), "")
 WF_DIR = ROOT / ".github" / "workflows"
 TOOLS_DIR = ROOT / "tools"
 WF_DIR.mkdir(parents=True, exist_ok=True)
@@ -26,37 +36,245 @@ TOOLS_DIR.mkdir(parents=True, exist_ok=True)
 SCAN_JSON = TOOLS_DIR / "airysdark_ai_scan.json"
 PR_BODY_DETECT = ROOT / "pr_body_detect.md"
 
-# ---------------- Full-repo scan ----------------
+# ---------------- Output files ----------------
 
-def scan_all_files(max_files=10000) -> List[Tuple[str, pathlib.Path]]:
-    files = []
-    for r, ds, fs in os.walk(ROOT):
-        if ".git" in ds:
-            ds.remove(".git")
-        for fn in fs:
-            p = pathlib.Path(r) / fn
-            try:
-                rel = p.relative_to(ROOT)
-            except Exception:
-                rel = p
-            files.append((fn.lower(), rel))
-            if len(files) >= max_files:
-                return files
-    return files
-
-def read_text_safe(p: pathlib.Path) -> str:
+# (path, encoded bytes) queued by the writers below and written together by
+# flush_writes() at the end of main.
+_PENDING_WRITES: List[Tuple[pathlib.Path, bytes]] = []
+
+def queue_write(path: pathlib.Path, data: Union[str, bytes]):
+    _PENDING_WRITES.append((path, data.encode("utf-8") if isinstance(data, str) else data))
+
+# Above this many list entries (evidence lines + dir hints + sample files) the
+# scan JSON is written compact; indenting it only helps a human skim a small one.
+SCAN_JSON_INDENT_MAX = 2000
+
+def scan_json_bytes(scan: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(scan, option=orjson.OPT_INDENT_2)
+    size = len(scan.get("dir_hints", ())) + len(scan.get("sample_files", ()))
+    size += sum(len(v) for v in scan.get("evidence", {}).values())
+    if size <= SCAN_JSON_INDENT_MAX:
+        return json.dumps(scan, indent=2).encode("utf-8")
+    return json.dumps(scan, separators=(",", ":")).encode("utf-8")
+
+def _same_content(path, data: bytes) -> bool:
+    """True if `path` already holds exactly `data`; a size mismatch (the usual
+    case for a changed file) answers from one stat without reading it."""
+    try:
+        if os.stat(path).st_size != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+def flush_writes():
+    """One open/write/close per queued file, bypassing the TextIOWrapper path.
+    Each file is written next to its target and renamed over it, so a reader
+    (or an interrupted run) never sees a half-written output. Unchanged files
+    are left alone, which also keeps the scan cache's dir stamps valid."""
+    for path, data in _PENDING_WRITES:
+        if _same_content(path, data):
+            continue
+        tmp = f"{path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    _PENDING_WRITES.clear()
+    if _CACHE_PENDING is not None:
+        _write_scan_cache()
+
+# ---------------- Scan cache ----------------
+
+# The scan depends only on file names (directory listings) and CMakeLists
+# content, so a rerun can reuse it when no scanned directory and no CMakeLists
+# has a new mtime. On a rescan, CMakeLists whose (mtime, size) is unchanged keep
+# their cached flavor. AI_DETECT_CACHE=0 disables both.
+# The cache lives outside the work tree (AI_DETECT_CACHE_DIR, else the user cache
+# dir), one file per ROOT, so it never shows up in `git add -A` or a PR.
+DETECT_CACHE = os.getenv("AI_DETECT_CACHE", "1") != "0"
+CACHE_DIR = pathlib.Path(os.getenv("AI_DETECT_CACHE_DIR") or os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "airysdark"))
+CACHE_JSON = CACHE_DIR / f"detect-{hashlib.sha1(str(ROOT).encode()).hexdigest()[:16]}.json"
+_TOOL_MTIME = os.stat(__file__).st_mtime_ns
+
+def _stat_key(rel: str):
+    """[mtime_ns, size] of a repo file, or None if it can't be stat'ed."""
     try:
-        return (ROOT / p).read_text(errors="ignore")
+        st = os.stat(ROOT_PREFIX + rel)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def _read_cache() -> dict:
+    if not DETECT_CACHE:
+        return {}
+    try:
+        cache = json.loads(CACHE_JSON.read_bytes())
     except Exception:
-        return ""
+        return {}
+    return cache if cache.get("tool") == _TOOL_MTIME else {}
+
+_PREV_CACHE = _read_cache()
+
+def _scan_opts() -> list:
+    """Env-driven settings that change what a full scan reports."""
+    return [sorted(SKIP_DIRS), DEDUP_HARDLINKS]
+
+def load_scan_cache():
+    """Cached scan dict if still valid for this tree, else None."""
+    if not _PREV_CACHE or _PREV_CACHE.get("opts") != _scan_opts():
+        return None
+    if not all(_mtime_ns(ROOT_PREFIX + d) == ns for d, ns in _PREV_CACHE.get("dirs", {}).items()):
+        return None
+    if not all(_stat_key(p) == v[:2] for p, v in _PREV_CACHE.get("cmake", {}).items()):
+        return None
+    return _PREV_CACHE.get("scan")
+
+def cached_cmake_flavor(rel: str, flavors: Dict[str, list]) -> str:
+    """cmakelists_flavor for one file, reused from the previous run when its
+    (mtime, size) is unchanged. Records [mtime_ns, size, flavor] in `flavors`."""
+    key = _stat_key(rel)
+    old = _PREV_CACHE.get("cmake", {}).get(rel)
+    if key is not None and old is not None and old[:2] == key:
+        flavor = old[2]
+    else:
+        flavor = cmakelists_flavor(cmake_head(rel))
+    if key is not None:
+        flavors[rel] = key + [flavor]
+    return flavor
+
+_CACHE_PENDING = None  # (scan, dirs, cmake flavors) saved by flush_writes()
+
+def save_scan_cache(scan: dict, dirs: List[str], flavors: Dict[str, list]):
+    global _CACHE_PENDING
+    if DETECT_CACHE:
+        _CACHE_PENDING = (scan, dirs, flavors)
+
+def _write_scan_cache():
+    """Stamp mtimes after every output exists, so our own writes don't invalidate
+    the next run."""
+    scan, dirs, flavors = _CACHE_PENDING
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache = {
+            "tool": _TOOL_MTIME,
+            "opts": _scan_opts(),
+            "dirs": {d: _mtime_ns(ROOT_PREFIX + d) for d in dirs},
+            "cmake": flavors,
+            "scan": scan,
+        }
+        CACHE_JSON.write_text(json.dumps(cache, separators=(",", ":")), encoding="utf-8")
+    except OSError as e:
+        print(f"⚠️ Could not write scan cache: {e}")
 
-def collect_dir_name_hints(files: List[Tuple[str, pathlib.Path]]) -> List[str]:
-    names = set()
-    for _, rel in files:
-        for part in pathlib.Path(rel).parts:
-            names.add(part.lower())
-    # return as sorted list for JSON stability
-    return sorted(names)
+# ---------------- Full-repo scan ----------------
+
+# Directories that never decide the build type but can hold most of a checkout.
+# AIRYSDARK_PRUNE adds comma-separated names (matched case-insensitively).
+SKIP_DIRS = {".git", "node_modules", ".gradle", "build", "target", "out", "dist", ".idea",
+             ".venv", "venv", "__pycache__", ".tox", ".mypy_cache", ".pytest_cache",
+             "bazel-bin", "bazel-out", "bazel-testlogs"}
+SKIP_DIRS.update(n.strip().lower() for n in os.getenv("AIRYSDARK_PRUNE", "").split(",") if n.strip())
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+def _scan_dir(d: str, root_len: int) -> Tuple[List[str], List[str], List[str]]:
+    """One scandir of `d`: lowercased file names, relative paths, and subdirectories to visit."""
+    names: List[str] = []
+    rels: List[str] = []
+    subdirs: List[str] = []
+    add_name, add_rel = names.append, rels.append
+    try:
+        it = os.scandir(d)
+    except OSError:
+        return names, rels, subdirs
+    with it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name.lower() not in SKIP_DIRS:
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            add_name(entry.name)
+            add_rel(entry.path[root_len:])
+    # Lowercase in one C-level map rather than a method lookup per entry.
+    return list(map(str.lower, names)), rels, subdirs
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return -1
+
+def _scan_tree(top: str, root_len: int, max_files: int) -> Tuple[List[str], List[str], List[str]]:
+    names_lc: List[str] = []
+    rels: List[str] = []
+    dirs: List[str] = []
+    stack = [top]
+    while stack and len(rels) < max_files:
+        d = stack.pop()
+        dirs.append(d[root_len:])
+        n, r, sub = _scan_dir(d, root_len)
+        names_lc += n
+        rels += r
+        stack += sub
+    return names_lc, rels, dirs
+
+def scan_all_files(max_files=10000, stop=None, dirs=None) -> List[str]:
+    """Repo-relative paths of up to `max_files` files.
+
+    Top-level subtrees are walked concurrently; scandir releases the GIL, so the
+    metadata syscalls overlap. `stop(names, rels, dirs)` is fed every batch that
+    ends up in the result (the ROOT listing, then each subtree in order, with the
+    relative directories that batch listed) and ends the scan early, cancelling
+    unstarted subtrees, once it returns True. Lowercased names only live per
+    batch; classify them in stop() rather than keeping a repo-sized list.
+    If `dirs` is a list, every directory listed is appended to it (relative,
+    "" for ROOT).
+    """
+    root_len = len(ROOT_PREFIX)
+    if dirs is not None:
+        dirs.append("")
+    names_lc, rels, subdirs = _scan_dir(str(ROOT), root_len)
+    del names_lc[max_files:], rels[max_files:]
+    if (stop is not None and stop(names_lc, rels, [])) or len(rels) >= max_files or not subdirs:
+        return rels
+    with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(subdirs))) as ex:
+        for n, r, dm in ex.map(lambda d: _scan_tree(d, root_len, max_files), subdirs):
+            room = max_files - len(rels)
+            n, r = n[:room], r[:room]
+            rels += r
+            if dirs is not None:
+                dirs += dm
+            if (stop is not None and stop(n, r, dm)) or len(rels) >= max_files:
+                ex.shutdown(wait=False, cancel_futures=True)
+                break
+    return rels
+
+def cmake_head(p: str, limit: int = 65536) -> bytes:
+    """ASCII-lowercased first `limit` bytes of a file; the classifier hints live
+    near the top and are plain ASCII, so no decode is needed."""
+    # Raw fd read: no buffered-reader setup and no fstat for a block-size hint.
+    try:
+        fd = os.open(ROOT_PREFIX + p, os.O_RDONLY)
+    except OSError:
+        return b""
+    try:
+        return os.read(fd, limit).lower()
+    except OSError:
+        return b""
+    finally:
+        os.close(fd)
 
 # ---------------- CMake classifier ----------------
 
@@ -65,152 +283,246 @@ ANDROID_HINTS = (
     "find_library(log)", "log-lib", "loglib",
 )
 
-DESKTOP_HINTS = (
-    "add_executable", "pkgconfig", "find_package(", "threads", "pthread", "x11", "wayland", "gtk", "qt",
-    "set(cmake_system_name linux",
+# Hints that contain a shorter hint ("android_abi" has "android") can never change
+# the outcome, so only the minimal set is searched. A few bytes `in` searches
+# (memchr-driven in C) beat both a regex alternation, which tries every branch
+# at every offset, and an Aho-Corasick pass: ~2x and ~1.5x on 64 KiB heads.
+_ANDROID_HINT_BYTES = tuple(
+    h.encode() for h in ANDROID_HINTS if not any(o != h and o in h for o in ANDROID_HINTS)
 )
 
-def cmakelists_flavor(cm_txt: str) -> str:
-    t = cm_txt.lower()
-    if any(h in t for h in ANDROID_HINTS):
-        return "android"
-    if any(h in t for h in DESKTOP_HINTS):
-        return "desktop"
-    return "desktop"  # default bias
+def cmakelists_flavor(t: bytes) -> str:
+    """Classify already-lowercased CMakeLists bytes. Desktop is the default, so only
+    the Android hints need a scan."""
+    for h in _ANDROID_HINT_BYTES:
+        if h in t:
+            return "android"
+    return "desktop"
 
 # ---------------- Detection ----------------
 
-def detect_types() -> Tuple[List[str], Dict[str, List[str]]]:
-    files = scan_all_files()
-    fnames = [n for n, _ in files]
-    rels   = [str(p).lower() for _, p in files]
-    dir_hints = collect_dir_name_hints(files)
+# (key, type, evidence label) for build systems where one marker file is enough,
+# in the order they are reported.
+FIRST_HITS = (
+    ("package.json", "node", "found package.json"),
+    ("pyproject.toml", "python", "found pyproject.toml"),
+    ("setup.py", "python", "found setup.py"),
+    ("cargo.toml", "rust", "found Cargo.toml"),
+    ("dotnet", "dotnet", "found .NET project"),
+    ("pom.xml", "maven", "found pom.xml"),
+    ("pubspec.yaml", "flutter", "found pubspec.yaml"),
+    ("go.mod", "go", "found go.mod"),
+    ("bazel", "bazel", "found Bazel file"),
+    ("scons", "scons", "found SCons file"),
+)
+
+FIRST_HIT_NAMES = {
+    "package.json": "package.json", "pyproject.toml": "pyproject.toml", "setup.py": "setup.py",
+    "cargo.toml": "cargo.toml", "pom.xml": "pom.xml", "pubspec.yaml": "pubspec.yaml", "go.mod": "go.mod",
+    "workspace": "bazel", "workspace.bazel": "bazel", "module.bazel": "bazel", "build": "bazel", "build.bazel": "bazel",
+    "sconstruct": "scons", "sconscript": "scons",
+}
+
+_FIRST_HIT_TYPE = {key: t for key, t, _ in FIRST_HITS}
+
+# Every type detect_types can report from the scan; once all are seen, walking
+# further can only add evidence lines.
+ALL_TYPES = frozenset({"android", "cmake", "linux", "ninja", "windows"} | set(_FIRST_HIT_TYPE.values()))
+
+# Multi-file build families, keyed by lowercased name: exact names first, then
+# the Gradle prefixes (build.gradle.kts, settings.gradle.kts, ...), then the
+# text after the last ".". Two dict probes per name; most files miss both.
+_FAMILY_NAMES = {
+    "gradlew": "wrapper", "cmakelists.txt": "cmake", "makefile": "make", "gnumakefile": "make",
+    "meson.build": "meson", "build.ninja": "ninja",
+}
+_GRADLE_PREFIXES = ("build.gradle", "settings.gradle")
+_FAMILY_EXTS = {".mk": "make", ".sln": "dotnet", ".csproj": "dotnet", ".fsproj": "dotnet"}
+
+# family -> (type, evidence label) for families whose every file is reported
+_FAMILY_EV = {
+    "wrapper": ("android", "found wrapper"),
+    "gradle": ("android", "found gradle"),
+    "settings": ("android", "found gradle settings"),
+    "make": ("linux", "found make build file"),
+    "meson": ("linux", "found Meson build"),
+    "ninja": ("ninja", "found Ninja build"),
+}
+
+def new_scan_state() -> dict:
+    return {
+        "hints": set(),        # lowercased directory names (folder-name hints)
+        "gradle_ev": [],       # (type, evidence) for every gradle file
+        "cmake_paths": [],
+        "make_ev": [],         # (type, evidence) for every make/meson/ninja file
+        "first": {},           # FIRST_HITS key -> first matching rel path
+        "seen": set(),         # types with at least one marker so far
+        "inodes": set(),       # (st_dev, st_ino) of hard-linked markers, for DEDUP_HARDLINKS
+    }
+
+# Opt-in: when ROOT itself holds gradlew or settings.gradle(.kts), report from the
+# ROOT listing alone instead of walking the tree. Fewer evidence lines and no
+# nested build systems, so it is off by default.
+FAST_ANDROID = os.getenv("AIRYSDARK_FAST", "0") not in ("", "0")
+
+_ROOT_ANDROID_NAMES = frozenset({"gradlew", "settings.gradle", "settings.gradle.kts"})
 
-    evidence: Dict[str, List[str]] = {}
-    types: List[str] = []
+def root_is_android(names: List[str]) -> bool:
+    return not _ROOT_ANDROID_NAMES.isdisjoint(names)
+
+# Opt-in: report a hard-linked marker file once, not once per link. Only files
+# that matched a multi-file family are stat'ed, and only multi-link ones remembered.
+DEDUP_HARDLINKS = os.getenv("AIRYSDARK_DEDUP_INODES", "0") not in ("", "0")
+
+def _is_linked_duplicate(inodes: set, rel: str) -> bool:
+    try:
+        st = os.stat(ROOT_PREFIX + rel, follow_symlinks=False)
+    except OSError:
+        return False
+    if st.st_nlink < 2:
+        return False
+    key = (st.st_dev, st.st_ino)
+    if key in inodes:
+        return True
+    inodes.add(key)
+    return False
+
+def classify_batch(state: dict, names: List[str], rels: List[str], dirs: List[str]) -> bool:
+    """Fold one scanned batch into `state`; True once every type in ALL_TYPES is seen.
+    Used as scan_all_files' stop() so classification happens as the scan streams in."""
+    gradle_ev, make_ev, cmake_paths = state["gradle_ev"], state["make_ev"], state["cmake_paths"]
+    first, seen = state["first"], state["seen"]
+    for name, rel in zip(names, rels):
+        fam = _FAMILY_NAMES.get(name)
+        if fam is None:
+            if name.startswith(_GRADLE_PREFIXES):
+                fam = "gradle" if name[0] == "b" else "settings"
+            else:
+                fam = _FAMILY_EXTS.get(name[name.rfind("."):])
+                if fam is None:
+                    key = FIRST_HIT_NAMES.get(name)
+                    if key is not None and key not in first:
+                        first[key] = rel
+                        seen.add(_FIRST_HIT_TYPE[key])
+                    continue
+        if DEDUP_HARDLINKS and _is_linked_duplicate(state["inodes"], rel):
+            continue
+        if fam == "cmake":
+            cmake_paths.append(rel)
+            seen.add("cmake")
+        elif fam == "dotnet":
+            first.setdefault("dotnet", rel)
+            seen.add("dotnet")
+        else:
+            t, label = _FAMILY_EV[fam]
+            (gradle_ev if t == "android" else make_ev).append((t, f"{label}: {rel}"))
+            seen.add(t)
+    # Folder hints come from the directories listed, O(dirs) rather than
+    # splitting every file path.
+    hints = state["hints"]
+    hints.update(d[d.rfind(os.sep) + 1:] for d in map(str.lower, dirs))
+    if "windows" in hints:
+        seen.add("windows")
+    return seen >= ALL_TYPES
+
+def detect_types() -> Tuple[List[str], Dict[str, List[str]]]:
+    scan = load_scan_cache()
+    if scan is not None:
+        print("Scan cache hit:", CACHE_JSON)
+        queue_write(SCAN_JSON, scan_json_bytes(scan))
+        return scan["types"], scan["evidence"], scan["dir_hints"], scan["sample_files"]
+
+    dirs: List[str] = []
+    state = new_scan_state()
+    fast = []
+
+    def stop(n, r, d):
+        if classify_batch(state, n, r, d):
+            return True
+        # ROOT is the only batch with no listed dirs
+        if FAST_ANDROID and not d and root_is_android(n):
+            fast.append(True)
+            print("Fast path: Android wrapper/settings at repo root, skipping deep scan")
+            return True
+        return False
+
+    rels = scan_all_files(stop=stop, dirs=dirs)
+    hint_set = state["hints"]
+    # sorted list for JSON stability; membership tests use the set
+    dir_hints = sorted(hint_set)
+
+    # type -> evidence lines as dict keys: first-add order for both types and
+    # lines, with repeats dropped on insert instead of in a later pass.
+    ev_dicts: Dict[str, Dict[str, None]] = {}
 
     def add(t: str, why: str):
-        if t not in types:
-            types.append(t)
-        evidence.setdefault(t, []).append(why)
+        ev_dicts.setdefault(t, {})[why] = None
 
     # Folder-name hints (broad)
-    if "linux" in dir_hints:
+    if "linux" in hint_set:
         add("linux", "folder hint: 'linux' present in path segments")
-    if "android" in dir_hints:
+    if "android" in hint_set:
         add("android", "folder hint: 'android' present in path segments")
-    if "windows" in dir_hints:
+    if "windows" in hint_set:
         add("windows", "folder hint: 'windows' present in path segments")
 
+    # Gradle/make evidence is kept in full; the single-marker build systems
+    # only need their first hit.
+    gradle_ev, cmake_paths, make_ev, first = state["gradle_ev"], state["cmake_paths"], state["make_ev"], state["first"]
+
     # Android / Gradle
-    for name, rel in files:
-        if name == "gradlew":
-            add("android", f"found wrapper: {rel}")
-        if name.startswith("build.gradle"):
-            add("android", f"found gradle: {rel}")
-        if name.startswith("settings.gradle"):
-            add("android", f"found gradle settings: {rel}")
+    for t, why in gradle_ev:
+        add(t, why)
 
     # CMake
-    cmake_paths = [rel for (n, rel) in files if n == "cmakelists.txt"]
+    flavors: Dict[str, list] = {}
     if cmake_paths:
         add("cmake", f"found {len(cmake_paths)} CMakeLists.txt")
-        for p in cmake_paths:
-            txt = read_text_safe(p)
-            flavor = cmakelists_flavor(txt)
+        # Reads are independent and release the GIL; evidence is still added in
+        # scan order from the mapped results. A lone file skips the pool setup.
+        if len(cmake_paths) == 1:
+            results = [cached_cmake_flavor(cmake_paths[0], flavors)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(cmake_paths))) as ex:
+                results = list(ex.map(lambda p: cached_cmake_flavor(p, flavors), cmake_paths))
+        for p, flavor in zip(cmake_paths, results):
             if flavor == "desktop":
                 add("linux", f"CMakeLists suggests desktop build: {p}")
             else:
                 add("android", f"CMakeLists suggests Android/NDK: {p}")
 
     # Linux umbrella
-    for name, rel in files:
-        if name in ("makefile", "gnumakefile") or name.endswith(".mk"):
-            add("linux", f"found make build file: {rel}")
-        if name == "meson.build":
-            add("linux", f"found Meson build: {rel}")
-        if name == "build.ninja":
-            add("ninja", f"found Ninja build: {rel}")
-
-    # Node
-    for name, rel in files:
-        if name == "package.json":
-            add("node", f"found package.json: {rel}")
-            break
-
-    # Python
-    for name, rel in files:
-        if name == "pyproject.toml":
-            add("python", f"found pyproject.toml: {rel}")
-            break
-    for name, rel in files:
-        if name == "setup.py":
-            add("python", f"found setup.py: {rel}")
-            break
-
-    # Rust
-    for name, rel in files:
-        if name == "cargo.toml":
-            add("rust", f"found Cargo.toml: {rel}")
-            break
-
-    # .NET
-    for name, rel in files:
-        if name.endswith(".sln") or name.endswith(".csproj") or name.endswith(".fsproj"):
-            add("dotnet", f"found .NET project: {rel}")
-            break
-
-    # Maven
-    for name, rel in files:
-        if name == "pom.xml":
-            add("maven", f"found pom.xml: {rel}")
-            break
-
-    # Flutter
-    for name, rel in files:
-        if name == "pubspec.yaml":
-            add("flutter", f"found pubspec.yaml: {rel}")
-            break
-
-    # Go
-    for name, rel in files:
-        if name == "go.mod":
-            add("go", f"found go.mod: {rel}")
-            break
-
-    # Bazel
-    for name, rel in files:
-        base = os.path.basename(str(rel)).lower()
-        if name in ("workspace", "workspace.bazel", "module.bazel") or base in ("build", "build.bazel"):
-            add("bazel", f"found Bazel file: {rel}")
-            break
-
-    # SCons
-    for name, rel in files:
-        if name in ("sconstruct", "sconscript"):
-            add("scons", f"found SCons file: {rel}")
-            break
-
-    if not types:
+    for t, why in make_ev:
+        add(t, why)
+
+    # Node, Python, Rust, .NET, Maven, Flutter, Go, Bazel, SCons
+    for key, t, label in FIRST_HITS:
+        if key in first:
+            add(t, f"{label}: {first[key]}")
+
+    if not ev_dicts:
         add("unknown", "no known build system files detected")
+    types = list(ev_dicts)
+    evidence = {t: list(d) for t, d in ev_dicts.items()}
 
     # Add top-level hints and a short file sample to the scan JSON
-    sample_files = [str(p) for _, p in files[:200]]
+    sample_files = rels[:200]
     scan = {
         "types": types,
         "evidence": evidence,
         "dir_hints": dir_hints,
         "sample_files": sample_files,
     }
-    SCAN_JSON.write_text(json.dumps(scan, indent=2), encoding="utf-8")
+    queue_write(SCAN_JSON, scan_json_bytes(scan))
+    if not fast:  # a partial scan must not satisfy a later full run
+        save_scan_cache(scan, dirs, flavors)
 
     return types, evidence, dir_hints, sample_files
 
 # ---------------- PROBE workflow template (patched for KB + tokens) ----------------
 
-def write_prob_workflow():
-    """Write a single manual-run probe workflow with KB caching/collection & proper tokens."""
-    yml = textwrap.dedent("""\
+# Dedented once at import rather than on every write.
+_PROB_WF_YML = textwrap.dedent("""\
     name: AirysDark-AI - Probe (LLM builds workflow)
 
     on:
@@ -373,7 +685,10 @@ def write_prob_workflow():
               body-path: pr_body_build.md
               labels: automation, ci
     """)
-    (WF_DIR / "AirysDark-AI_prob.yml").write_text(yml, encoding="utf-8")
+
+def write_prob_workflow():
+    """Write a single manual-run probe workflow with KB caching/collection & proper tokens."""
+    queue_write(WF_DIR / "AirysDark-AI_prob.yml", _PROB_WF_YML)
     print(f"✅ Wrote: {WF_DIR}/AirysDark-AI_prob.yml")
 
 # ---------------- PR body (Detector) ----------------
@@ -396,7 +711,7 @@ def write_pr_body_detect(types: List[str], evidence: Dict[str, List[str]]):
     lines.append("2. Merge this PR.")
     lines.append("3. From the Actions tab, manually run **AirysDark-AI - Probe (LLM builds workflow)**.")
     lines.append("")
-    PR_BODY_DETECT.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    queue_write(PR_BODY_DETECT, "\n".join(lines) + "\n")
     print(f"✅ Wrote: {PR_BODY_DETECT}")
 
 # ---------------- Main ----------------
@@ -406,6 +721,7 @@ def main():
     print("Detected types:", types)
     write_prob_workflow()
     write_pr_body_detect(types, evidence)
+    flush_writes()
     print("Done. Generated PROBE workflow + scan JSON + PR body.")
 
 if __name__ == "__main__":
@@ -28,6 +28,8 @@ import re
 import sys
 import json
 import shlex
+import collections
+import functools
 import pathlib
 import textwrap
 import subprocess
@@ -49,6 +51,18 @@ ANDROID_WF = WF_DIR / "AirysDark-AI_android.yml"       # Android-only workflow
 
 # ---------------- Utilities ----------------
 
+def write_if_changed(path: pathlib.Path, text: str | bytes) -> bool:
+    """Skip the write (and the git churn) when the file already has this content."""
+    new = text.encode("utf-8") if isinstance(text, str) else text
+    try:
+        # plain bytes compare: stops at a length mismatch, no hashing of either side
+        if path.read_bytes() == new:
+            return False
+    except FileNotFoundError:
+        pass
+    path.write_bytes(new)
+    return True
+
 def read_scan_json():
     if not SCAN_JSON.exists():
         return {}
@@ -57,46 +71,81 @@ def read_scan_json():
     except Exception as e:
         return {"_error": f"failed to parse {SCAN_JSON}: {e}"}
 
+# Single-dot extensions, so membership of the lowercased text after the last "."
+# is the same test as endswith() on the lowercased path without copying all of it.
+_SNAPSHOT_TEXT_EXTS = frozenset((
+    ".md",".txt",".rst",".ini",".cfg",".toml",".gradle",".kts",".xml",".yml",".yaml",".json",
+    ".properties",".mk",".cmake",".ninja",".conf",".bat",".ps1",".sh",".groovy",".kt",".java",
+    ".cpp",".c",".h",".hpp",".swift",".go",".cs",".py",".rb",".ts",".js",".mjs",".cjs",".sql",
+))
+
+@functools.lru_cache(maxsize=1)
+def repo_files() -> tuple:
+    """Every file under ROOT (except .git) as a relative path, in os.walk order.
+
+    Walked once per run with scandir on an explicit stack; repo_snapshot and the
+    find_first lookups of the build heuristics all share this listing.
+    """
+    files = []
+    root_len = len(os.path.join(str(ROOT), ""))
+    stack = [str(ROOT)]
+    while stack:
+        subdirs = []
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != ".git":
+                            subdirs.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry.path[root_len:])
+                except OSError:
+                    continue
+        # reversed so subdirectories are visited in listing order, like os.walk
+        stack.extend(reversed(subdirs))
+    return tuple(files)
+
 def repo_snapshot(max_files=6000, max_text_lines=80):
     """
     Walk entire repo (except .git), list files, and capture heads of many text/code files.
     """
-    files = []
+    files = list(repo_files()[:max_files])
     doc_hints = {}
-    for r, ds, fs in os.walk(ROOT):
-        if ".git" in ds:
-            ds.remove(".git")
-        for fn in fs:
-            p = pathlib.Path(r) / fn
+    for rel in files:
+        if rel[rel.rfind("."):].lower() in _SNAPSHOT_TEXT_EXTS:
             try:
-                rel = str(p.relative_to(ROOT))
+                lines = ((ROOT / rel).read_text(errors="ignore").splitlines())[:max_text_lines]
+                doc_hints[rel] = lines
             except Exception:
-                rel = str(p)
-            files.append(rel)
-
-            lower = fn.lower()
-            if lower.endswith((
-                ".md",".txt",".rst",".ini",".cfg",".toml",".gradle",".kts",".xml",".yml",".yaml",".json",
-                ".properties",".mk",".cmake",".ninja",".conf",".bat",".ps1",".sh",".groovy",".kt",".java",
-                ".cpp",".c",".h",".hpp",".swift",".go",".cs",".py",".rb",".ts",".js",".mjs",".cjs",".sql",
-            )):
-                try:
-                    lines = (p.read_text(errors="ignore").splitlines())[:max_text_lines]
-                    doc_hints[rel] = lines
-                except Exception:
-                    pass
-
-            if len(files) >= max_files:
-                break
-        if len(files) >= max_files:
-            break
+                pass
     return {"files": files, "doc_hints": doc_hints}
 
+@functools.lru_cache(maxsize=1)
+def files_by_name() -> dict:
+    """repo_files() bucketed by base name, each bucket in walk order."""
+    by_name = collections.defaultdict(list)
+    for rel in repo_files():
+        by_name[rel[rel.rfind(os.sep) + 1:]].append(rel)
+    return by_name
+
 def find_first(globs):
+    """First file matching one of `globs` ("name" at the root or "**/name" at any
+    depth): a bucket lookup in files_by_name() instead of a glob walk."""
+    by_name = files_by_name()
     for g in globs:
-        found = list(ROOT.glob(g))
-        if found:
-            return found[0]
+        deep = g.startswith("**/")
+        name = g[3:] if deep else g
+        bucket = by_name.get(name)
+        if not bucket:
+            continue
+        if deep:
+            return ROOT / bucket[0]
+        if name in bucket:
+            return ROOT / name
     return None
 
 def _sh(cmd: str, cwd: pathlib.Path | None = None, timeout: int = 20):
@@ -110,13 +159,29 @@ def _sh(cmd: str, cwd: pathlib.Path | None = None, timeout: int = 20):
 
 # ---------------- Build command heuristics (original behavior) ----------------
 
+GRADLEW_SKIP_DIRS = {".git", "node_modules", "build", ".gradle", ".idea"}
+
+def _iter_gradlews(root: pathlib.Path = ROOT):
+    """Breadth-first os.scandir search: shallowest gradlew wrappers come out first."""
+    queue = collections.deque([str(root)])
+    while queue:
+        d = queue.popleft()
+        try:
+            entries = sorted(os.scandir(d), key=lambda e: e.name)
+        except OSError:
+            continue
+        for e in entries:
+            if e.name == "gradlew" and e.is_file():
+                yield pathlib.Path(e.path)
+            elif e.name not in GRADLEW_SKIP_DIRS and e.is_dir(follow_symlinks=False):
+                queue.append(e.path)
+
 def guess_android_cmd():
-    wrappers = [ROOT / "gradlew", *ROOT.glob("**/gradlew")]
-    wrappers = [w for w in wrappers if w.exists()]
-    if not wrappers:
+    # first BFS hit = closest to root, which avoids nested sample projects;
+    # the walk stops there instead of globbing the whole tree
+    g = next(_iter_gradlews(), None)
+    if g is None:
         return "./gradlew assembleDebug --stacktrace"
-    # prefer the shortest path (closest to root) to avoid nested sample projects
-    g = sorted(wrappers, key=lambda p: len(str(p)))[0]
     gradle_dir = g.parent
 
     # Try to parse settings for modules
@@ -207,13 +272,7 @@ def propose_build_cmd(target: str) -> str:
 # ---------------- EXTRA: Android deep probe ----------------
 
 def _find_gradlews_all():
-    gws = []
-    if (ROOT / "gradlew").exists():
-        gws.append(ROOT / "gradlew")
-    for p in ROOT.glob("**/gradlew"):
-        if p not in gws:
-            gws.append(p)
-    return gws
+    return list(_iter_gradlews())  # root wrapper (if any) first
 
 def _parse_settings_modules(txt: str):
     mods = set()
@@ -278,74 +337,107 @@ def android_deep_probe():
 
 # ---------------- Setup steps for generic build workflow ----------------
 
-def setup_steps_yaml(ptype: str) -> str:
-    if ptype == "android":
-        return textwrap.dedent("""\
-          - uses: actions/setup-java@v4
-            with:
-              distribution: temurin
-              java-version: "17"
-          - uses: android-actions/setup-android@v3
-          - run: yes | sdkmanager --licenses
-          - run: sdkmanager "platform-tools" "platforms;android-34" "build-tools;34.0.0"
-        """)
-    if ptype == "node":
-        return textwrap.dedent("""\
-          - uses: actions/setup-node@v4
-            with:
-              node-version: "20"
-        """)
-    if ptype == "rust":
-        return textwrap.dedent("""\
-          - uses: dtolnay/rust-toolchain@stable
-          - run: rustc --version && cargo --version
-        """)
-    if ptype == "dotnet":
-        return textwrap.dedent("""\
-          - uses: actions/setup-dotnet@v4
-            with:
-              dotnet-version: "8.0.x"
-          - run: dotnet --info
-        """)
-    if ptype == "maven":
-        return textwrap.dedent("""\
-          - uses: actions/setup-java@v4
-            with:
-              distribution: temurin
-              java-version: "17"
-          - run: mvn --version
-        """)
-    if ptype == "flutter":
-        return textwrap.dedent("""\
-          - uses: subosito/flutter-action@v2
-            with:
-              flutter-version: "3.22.0"
-          - run: flutter --version
-        """)
-    if ptype == "go":
-        return textwrap.dedent("""\
-          - uses: actions/setup-go@v5
-            with:
-              go-version: "1.22"
-          - run: go version
-        """)
-    if ptype == "linux":
-        return textwrap.dedent("""\
-          - name: Install Meson & Ninja (Linux builds)
-            run: |
-              sudo apt-get update
-              sudo apt-get install -y meson ninja-build pkg-config
-        """)
-    # cmake/python/bazel/scons/ninja/unknown rely on setup-python only
-    return ""
+_RAW_SETUP = {
+    "android": """\
+      - uses: actions/setup-java@v4
+        with:
+          distribution: temurin
+          java-version: "17"
+      - uses: android-actions/setup-android@v3
+      - run: yes | sdkmanager --licenses
+      - run: sdkmanager "platform-tools" "platforms;android-34" "build-tools;34.0.0"
+    """,
+    "node": """\
+      - uses: actions/setup-node@v4
+        with:
+          node-version: "20"
+    """,
+    "rust": """\
+      - uses: dtolnay/rust-toolchain@stable
+      - run: rustc --version && cargo --version
+    """,
+    "dotnet": """\
+      - uses: actions/setup-dotnet@v4
+        with:
+          dotnet-version: "8.0.x"
+      - run: dotnet --info
+    """,
+    "maven": """\
+      - uses: actions/setup-java@v4
+        with:
+          distribution: temurin
+          java-version: "17"
+      - run: mvn --version
+    """,
+    "flutter": """\
+      - uses: subosito/flutter-action@v2
+        with:
+          flutter-version: "3.22.0"
+      - run: flutter --version
+    """,
+    "go": """\
+      - uses: actions/setup-go@v5
+        with:
+          go-version: "1.22"
+      - run: go version
+    """,
+    "linux": """\
+      - name: Install Meson & Ninja (Linux builds)
+        run: |
+          sudo apt-get update
+          sudo apt-get install -y meson ninja-build pkg-config
+    """,
+}
 
+# Dedented once at import; cmake/python/bazel/scons/ninja/unknown rely on setup-python only.
+_SETUP_BLOCKS = {ptype: textwrap.dedent(s) for ptype, s in _RAW_SETUP.items()}
+# ...and indented to the build workflow's step level, ready for the __SETUP__ slot.
+_SETUP_SLOTS = {ptype: textwrap.indent(s.rstrip("\n"), " " * 6) for ptype, s in _SETUP_BLOCKS.items()}
 
 # ---------------- Generic build workflow generation (patched) ----------------
 
-def render_build_workflow(target: str, build_cmd: str) -> str:
-    setup = setup_steps_yaml(target)
-    # Use placeholders to avoid interfering with ${{ }} in YAML
-    tmpl = r"""
+# Shared by the generic and Android workflows.
+_KB_PUSH_STEP = r"""
+      - name: Push KB snapshot to central collection repo
+        if: always() && env.KB_COLLECTION_REPO != '' && secrets.KB_PUSH_TOKEN != ''
+        shell: bash
+        run: |
+          set -euxo pipefail
+          if [ ! -s tools/ai_kb/knowledge.jsonl ]; then
+            echo "No knowledge.jsonl to push; skipping."
+            exit 0
+          fi
+          OWNER_REPO="${GITHUB_REPOSITORY}"
+          OWNER="${OWNER_REPO%%/*}"
+          REPO="${OWNER_REPO#*/}"
+          TS="$(date -u +'%Y-%m-%dT%H-%M-%SZ')"
+          WORKDIR="$(mktemp -d)"
+          git config --global user.name "airysdark-ai-bot"
+          git config --global user.email "airysdark-ai-bot@users.noreply.github.com"
+          git clone "https://x-access-token:${{ secrets.KB_PUSH_TOKEN }}@github.com/${{ env.KB_COLLECTION_REPO }}.git" "$WORKDIR/kb"
+          cd "$WORKDIR/kb"
+          mkdir -p "${OWNER}/${REPO}/snapshots"
+          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/knowledge.jsonl"
+          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/snapshots/${TS}.jsonl"
+          {
+            echo "repo: ${OWNER_REPO}"
+            echo "run_id: ${GITHUB_RUN_ID}"
+            echo "run_url: https://github.com/${OWNER_REPO}/actions/runs/${GITHUB_RUN_ID}"
+            echo "ref: ${GITHUB_REF}"
+            echo "timestamp: ${TS}"
+          } > "${OWNER}/${REPO}/snapshots/${TS}.meta"
+          git add -A
+          if git diff --cached --quiet; then
+            echo "No KB changes to push."
+            exit 0
+          fi
+          git commit -m "KB snapshot: ${OWNER_REPO} @ ${TS}"
+          git push origin HEAD:main
+""".lstrip("\n")
+
+# Use placeholders to avoid interfering with ${{ }} in YAML; the GitHub
+# expression markers are resolved once here, per-run values in render_build_workflow.
+_BUILD_WF_TMPL = ((r"""
 name: AirysDark-AI - Build (__PTYPE__)
 
 on:
@@ -422,7 +514,8 @@ __SETUP__
           rm -rf llama.cpp
           git clone --depth=1 https://github.com/ggml-org/llama.cpp
           cd llama.cpp
-          cmake -S . -B build -D CMAKE_BUILD_TYPE=Release -DLLAMA_CURL=OFF
+          # native + VNNI kernels for the runner CPU (the model is built and used on the same host)
+          cmake -S . -B build -DCMAKE_BUILD_TYPE=Release -DLLAMA_CURL=OFF -DGGML_NATIVE=ON -DGGML_AVX_VNNI=ON -DGGML_LTO=ON
           cmake --build build -j
           echo "LLAMA_CPP_BIN=$PWD/build/bin/llama-cli" >> $GITHUB_ENV
 
@@ -430,8 +523,8 @@ __SETUP__
         if: always() && __GHA__ steps.build.outputs.EXIT_CODE __GHA_END__ != '0'
         run: |
           mkdir -p models
-          curl -L -o models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf \
-            https://huggingface.co/TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF/resolve/main/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf
+          curl -L -o models/tinyllama-1.1b-chat-v1.0.Q4_0.gguf \
+            https://huggingface.co/TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF/resolve/main/tinyllama-1.1b-chat-v1.0.Q4_0.gguf
 
       - name: Attempt AI auto-fix (OpenAI → llama fallback)
         if: always() && __GHA__ steps.build.outputs.EXIT_CODE __GHA_END__ != '0'
@@ -440,7 +533,7 @@ __SETUP__
           FALLBACK_PROVIDER: llama
           OPENAI_API_KEY: __GHA__ secrets.OPENAI_API_KEY __GHA_END__
           OPENAI_MODEL: __GHA__ vars.OPENAI_MODEL || 'gpt-4o-mini' __GHA_END__
-          MODEL_PATH: models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf
+          MODEL_PATH: models/tinyllama-1.1b-chat-v1.0.Q4_0.gguf
           AI_BUILDER_ATTEMPTS: "3"
           BUILD_CMD: __GHA__ steps.build.outputs.BUILD_CMD __GHA_END__
         run: python3 tools/AirysDark-AI_builder.py || true
@@ -472,42 +565,7 @@ __SETUP__
           key: ai-kb-__PTYPE__-${{ github.repository }}-v1
 
       # ===== AI KB: push snapshot to collection repo (optional) via KB_PUSH_TOKEN =====
-      - name: Push KB snapshot to central collection repo
-        if: always() && env.KB_COLLECTION_REPO != '' && secrets.KB_PUSH_TOKEN != ''
-        shell: bash
-        run: |
-          set -euxo pipefail
-          if [ ! -s tools/ai_kb/knowledge.jsonl ]; then
-            echo "No knowledge.jsonl to push; skipping."
-            exit 0
-          fi
-          OWNER_REPO="${GITHUB_REPOSITORY}"
-          OWNER="${OWNER_REPO%%/*}"
-          REPO="${OWNER_REPO#*/}"
-          TS="$(date -u +'%Y-%m-%dT%H-%M-%SZ')"
-          WORKDIR="$(mktemp -d)"
-          git config --global user.name "airysdark-ai-bot"
-          git config --global user.email "airysdark-ai-bot@users.noreply.github.com"
-          git clone "https://x-access-token:${{ secrets.KB_PUSH_TOKEN }}@github.com/${{ env.KB_COLLECTION_REPO }}.git" "$WORKDIR/kb"
-          cd "$WORKDIR/kb"
-          mkdir -p "${OWNER}/${REPO}/snapshots"
-          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/knowledge.jsonl"
-          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/snapshots/${TS}.jsonl"
-          {
-            echo "repo: ${OWNER_REPO}"
-            echo "run_id: ${GITHUB_RUN_ID}"
-            echo "run_url: https://github.com/${OWNER_REPO}/actions/runs/${GITHUB_RUN_ID}"
-            echo "ref: ${GITHUB_REF}"
-            echo "timestamp: ${TS}"
-          } > "${OWNER}/${REPO}/snapshots/${TS}.meta"
-          git add -A
-          if git diff --cached --quiet; then
-            echo "No KB changes to push."
-            exit 0
-          fi
-          git commit -m "KB snapshot: ${OWNER_REPO} @ ${TS}"
-          git push origin HEAD:main
-
+""" + _KB_PUSH_STEP + r"""
       - name: Check for changes
         id: diff
         shell: bash
@@ -535,31 +593,25 @@ __SETUP__
             - Proposed a minimal fix via AI
             - Committed the changes for review
           labels: "automation, ci"
-""".lstrip("\n")
+""").lstrip("\n")
+    .replace("__GHA__", "${{")
+    .replace("__GHA_END__", "}}"))
 
-    setup_block = ""
-    if setup.strip():
-        setup_block = textwrap.indent(setup.rstrip("\n") + "\n", " " * 6)
+_BUILD_WF_SLOT_RE = re.compile(r"__(SETUP|PTYPE|BUILD_CMD)__")
 
-    yml = (tmpl
-           .replace("__SETUP__", setup_block.rstrip("\n"))
-           .replace("__PTYPE__", target)
-           .replace("__BUILD_CMD__", build_cmd.replace('"', '\\"'))
-           .replace("__GHA__", "${{")
-           .replace("__GHA_END__", "}}"))
-    return yml
+def render_build_workflow(target: str, build_cmd: str) -> str:
+    values = {
+        "SETUP": _SETUP_SLOTS.get(target, ""),
+        "PTYPE": target,
+        "BUILD_CMD": build_cmd.replace('"', '\\"'),
+    }
+    # One pass over the template; substituted values are never rescanned.
+    return _BUILD_WF_SLOT_RE.sub(lambda m: values[m.group(1)], _BUILD_WF_TMPL)
 
 
 # ---------------- Android-only workflow generation (patched) ----------------
 
-def write_workflow_android():
-    """
-    Android workflow calls the self-contained runner (tools/AirysDark-AI_android.py)
-    which handles probe/loop/fix internally. No extra fetching here.
-    Adds AI KB cache + optional KB push via KB_PUSH_TOKEN.
-    Also adds a conservative fallback 'builder.py' invocation if BUILD_CMD was exposed.
-    """
-    yml = r"""
+_ANDROID_WF_YML = (r"""
 name: AirysDark-AI - Android (generated)
 
 on:
@@ -731,42 +783,7 @@ jobs:
           path: tools/ai_kb
           key: ai-kb-android-${{ github.repository }}-v1
 
-      - name: Push KB snapshot to central collection repo
-        if: always() && env.KB_COLLECTION_REPO != '' && secrets.KB_PUSH_TOKEN != ''
-        shell: bash
-        run: |
-          set -euxo pipefail
-          if [ ! -s tools/ai_kb/knowledge.jsonl ]; then
-            echo "No knowledge.jsonl to push; skipping."
-            exit 0
-          fi
-          OWNER_REPO="${GITHUB_REPOSITORY}"
-          OWNER="${OWNER_REPO%%/*}"
-          REPO="${OWNER_REPO#*/}"
-          TS="$(date -u +'%Y-%m-%dT%H-%M-%SZ')"
-          WORKDIR="$(mktemp -d)"
-          git config --global user.name "airysdark-ai-bot"
-          git config --global user.email "airysdark-ai-bot@users.noreply.github.com"
-          git clone "https://x-access-token:${{ secrets.KB_PUSH_TOKEN }}@github.com/${{ env.KB_COLLECTION_REPO }}.git" "$WORKDIR/kb"
-          cd "$WORKDIR/kb"
-          mkdir -p "${OWNER}/${REPO}/snapshots"
-          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/knowledge.jsonl"
-          cp -f "$GITHUB_WORKSPACE/tools/ai_kb/knowledge.jsonl" "${OWNER}/${REPO}/snapshots/${TS}.jsonl"
-          {
-            echo "repo: ${OWNER_REPO}"
-            echo "run_id: ${GITHUB_RUN_ID}"
-            echo "run_url: https://github.com/${OWNER_REPO}/actions/runs/${GITHUB_RUN_ID}"
-            echo "ref: ${GITHUB_REF}"
-            echo "timestamp: ${TS}"
-          } > "${OWNER}/${REPO}/snapshots/${TS}.meta"
-          git add -A
-          if git diff --cached --quiet; then
-            echo "No KB changes to push."
-            exit 0
-          fi
-          git commit -m "KB snapshot: ${OWNER_REPO} @ ${TS}"
-          git push origin HEAD:main
-
+""" + _KB_PUSH_STEP + r"""
       - name: Stage changes
         id: diff
         run: |
@@ -790,43 +807,42 @@ jobs:
             - Build command: ${{ steps.run.outputs.BUILD_CMD }}
             - Logs: see artifact "android-ai-loop"
           labels: automation, ci
-""".lstrip("\n")
-    ANDROID_WF.write_text(yml, encoding="utf-8")
+""").lstrip("\n").encode("utf-8")
+
+def write_workflow_android():
+    """
+    Android workflow calls the self-contained runner (tools/AirysDark-AI_android.py)
+    which handles probe/loop/fix internally. No extra fetching here.
+    Adds AI KB cache + optional KB push via KB_PUSH_TOKEN.
+    Also adds a conservative fallback 'builder.py' invocation if BUILD_CMD was exposed.
+    """
+    write_if_changed(ANDROID_WF, _ANDROID_WF_YML)
     return str(ANDROID_WF)
 
 
 # ---------------- OpenAI (optional) ----------------
 
 def call_openai(prompt: str) -> str:
-    import requests
-    api = os.getenv("OPENAI_API_KEY")
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    if not api:
+    # one request path: AirysDark-AI_Request.py's client, streaming and retries
+    if not os.getenv("OPENAI_API_KEY"):
         raise RuntimeError("no_openai_key")
-    r = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={"Authorization": f"Bearer {api}", "Content-Type": "application/json"},
-        json={
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a CI assistant. Return only a valid GitHub Actions YAML workflow."},
-                {"role": "user", "content": prompt},
-            ],
-            "temperature": 0.2,
-        },
-        timeout=180,
-    )
-    if r.status_code >= 400:
-        raise RuntimeError(f"openai_error {r.status_code}: {r.text[:400]}")
-    out = r.json()["choices"][0]["message"]["content"].strip()
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "airysdark_ai_request", str(pathlib.Path(__file__).resolve().parent / "AirysDark-AI_Request.py"))
+    rq = importlib.util.module_from_spec(spec)  # type: ignore
+    spec.loader.exec_module(rq)  # type: ignore
+    out = rq.openai_complete(
+        prompt,
+        system="You are a CI assistant. Return only a valid GitHub Actions YAML workflow.",
+        temperature=0.2,
+    ).strip()
     out = re.sub(r"^```[a-zA-Z]*\n", "", out)
     out = re.sub(r"\n```$", "", out)
     return out
 
-def build_ai_prompt(context: dict, target: str, build_cmd: str) -> str:
-    files_list = "\n".join(context["repo"]["files"][:200])
-    detector_types = ", ".join(context["detector"].get("types", []))
-    return textwrap.dedent(f"""\
+# Dedented once here. Dedenting after substitution was a no-op: the unindented
+# file-list lines left no common margin, so the whole prompt kept a 4-space indent.
+_AI_PROMPT_TMPL = textwrap.dedent("""\
     Draft a GitHub Actions workflow named "AirysDark-AI - Build ({target})".
     Requirements:
     - triggers: workflow_dispatch only
@@ -848,6 +864,12 @@ def build_ai_prompt(context: dict, target: str, build_cmd: str) -> str:
     {files_list}
     """)
 
+def build_ai_prompt(context: dict, target: str, build_cmd: str) -> str:
+    files_list = "\n".join(context["repo"]["files"][:200])
+    detector_types = ", ".join(context["detector"].get("types", []))
+    return _AI_PROMPT_TMPL.format(target=target, build_cmd=build_cmd,
+                                  detector_types=detector_types, files_list=files_list)
+
 
 # ---------------- Main ----------------
 
@@ -906,7 +928,7 @@ def main():
         except Exception:
             wf_text = render_build_workflow(target, build_cmd)
             used_ai = False
-        BUILD_WF.write_text(wf_text, encoding="utf-8")
+        write_if_changed(BUILD_WF, wf_text)
         generated_path = str(BUILD_WF)
 
     # 6) PR body file